@@ -4,6 +4,7 @@ import time
 
 from trades.portfolio import stock_calculations
 from trades.portfolio.stock_calculations import get_securities_list
+from trades.prices import price_panel
 from trades.strategy.optimize import create_starting_values, create_single_solutions
 import pandas as pd
 
@@ -21,10 +22,15 @@ def make_default_factors(start_time, training_yrs, tickers):
     results_list = []
     now_time = start_time
     base_time = start_time-datetime.timedelta(days=365*training_yrs)
+    # One shared panel for the whole universe instead of a download per ticker
+    panel = price_panel.get_panel(tickers, base_time-datetime.timedelta(days=365), now_time)
     for ticker in tickers:
         try:
+            price_df = None
+            if panel is not None and ticker in panel.ticker_index:
+                price_df = panel.get_ticker(ticker)
             results, performance = create_single_solutions(
-                rules_list, buy_threshold, sell_threshold, ticker, base_time, now_time, bounds, goal)
+                rules_list, buy_threshold, sell_threshold, ticker, base_time, now_time, bounds, goal, price_df)
             results.append(ticker)
             results.append(base_time)
             results.append(now_time)
@@ -70,14 +76,18 @@ def build_portfolio():
     percentage_array = percentage_df.to_numpy()
 
     results_list = []
+    base_time = datetime.datetime.strptime("2016-01-01", '%Y-%m-%d')
+    now_time = base_time+datetime.timedelta(days=365)
+    panel = price_panel.get_panel(list(percentage_array[0:100, 4]), base_time-datetime.timedelta(days=365), now_time)
     for factors in percentage_array[0:100]:
         ticker = factors[4]
-        base_time = datetime.datetime.strptime("2016-01-01", '%Y-%m-%d')
-        now_time = base_time+datetime.timedelta(days=365)
         for i, rule in enumerate(rules_list):
             rules_list[i]['Percentage'] = factors[i]
 
-        values_df = get_roi(ticker, base_time, now_time, rules_list, buy_threshold, sell_threshold)
+        price_df = None
+        if panel is not None and ticker in panel.ticker_index:
+            price_df = panel.get_ticker(ticker)
+        values_df = get_roi(ticker, base_time, now_time, rules_list, buy_threshold, sell_threshold, 1000, price_df)
         roi = -1 * values_df['strategic_values'][-1] / values_df['strategic_values'][0]
         if not np.isnan(roi):
             results_list.append([-1*roi, ticker, *factors[0:4]])
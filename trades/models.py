@@ -1,3 +1,5 @@
+import uuid
+
 from trades import db
 from datetime import datetime
 
@@ -25,6 +27,12 @@ class Portfolio(db.Model):
     name = db.Column(db.String(50))
     strategy = db.Column(db.String(50))
     trades = db.relationship('Trade', backref='trades', lazy=True)
+    # When the stored daily values were last brought up to date, None once a change invalidated them
+    values_refreshed_at = db.Column(db.DateTime, default = None)
+    # Bumped by every change to the trades or the stored values, keys the cached results
+    version = db.Column(db.Integer, default = 0)
+    # Never reused, unlike the id of a deleted portfolio, so cached results cannot pass to a new one
+    cache_id = db.Column(db.String(32), default = lambda: uuid.uuid4().hex)
 
 
 class Strategy(db.Model):
@@ -55,6 +63,24 @@ class Trade(db.Model):
     strategy = db.Column(db.String(50))
 
 
+class PortfolioValue(db.Model):
+    # One day of a portfolio's valuation.  positions is a JSON object of trade id to lot value
+    # for the lots held that day, strategic_positions one of trade id to the strategic value and
+    # state of each externally funded lot, from which the next refresh continues its backtest.
+    __tablename__ = 'portfolio_values'
+    __table_args__ = (db.UniqueConstraint('portfolio_id', 'date'),)
+    id = db.Column(db.Integer, primary_key=True)
+    portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolios.id'), nullable=False)
+    date = db.Column(db.DateTime)
+    positions = db.Column(db.Text)
+    cash = db.Column(db.Float)
+    total = db.Column(db.Float)
+    invested = db.Column(db.Float)
+    roi = db.Column(db.Float)
+    strategic = db.Column(db.Float)
+    strategic_positions = db.Column(db.Text)
+
+
 class Signal(db.Model):
     __tablename__ = 'signals'
     id = db.Column(db.Integer, primary_key=True)
@@ -68,12 +94,16 @@ class Signal(db.Model):
 
 
 class Dollar(db.Model):
+    # One dated cash movement of a portfolio.  A sell adds its value (de_invested) and a purchase
+    # with internal funds takes its value (invested), so value is signed and the cash on a date is
+    # the sum of the entries up to it, read from the portfolio and date index.
     __tablename__ = 'dollars'
+    __table_args__ = (db.Index('ix_dollars_portfolio_date', 'portfolio_id', 'purchase_date', 'value'),)
     id = db.Column(db.Integer, primary_key=True)
     portfolio_id = db.Column(db.Integer, db.ForeignKey('portfolios.id'), nullable=False)
+    trade_id = db.Column(db.Integer, db.ForeignKey('trades.id'), index=True)
     purchase_date = db.Column(db.DateTime, default = datetime.utcnow)
     value = db.Column(db.Float)
     added = db.Column(db.Boolean, default = False)
     de_invested = db.Column(db.Boolean, default = False)
     invested = db.Column(db.Boolean, default = False)
-
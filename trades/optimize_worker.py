@@ -0,0 +1,6 @@
+# Starts the optimization worker.  trades.strategy imports optimize_jobs itself, so running that
+# module with -m would load it twice.
+from trades.strategy.optimize_jobs import run_worker
+
+if __name__ == "__main__":
+    run_worker()
@@ -10,7 +10,8 @@ import dash_html_components as html
 import dash_bootstrap_components as dbc
 
 from trades import db
-from trades.portfolio import manual_layouts, stock_calculations
+from trades.portfolio import manual_layouts, stock_calculations, portfolio_values, cash_ledger
+from trades.portfolio.portfolio_cache import portfolio_cache
 from trades.models import User, Trade, Portfolio, Dollar
 
 from trades import protect_dash_route
@@ -27,6 +28,23 @@ def get_portfolios():
     return portfolio_list
 
 
+def make_total_graphs(portfolio):
+    all_trades = Trade.query.filter_by(portfolio_id=portfolio.id).all()
+    values_df = portfolio_values.read_values(portfolio)
+    i_graph, t_graph, r_graph = stock_calculations.plot_stocks(all_trades, values_df)
+
+    i_graph.update_layout(yaxis=dict(title='Individual Closing Value ($)'),
+                          margin=dict(r=0, l=0, b=0, t=66), paper_bgcolor='#f9f9f9',
+                          title="Individual Closing Values")
+    t_graph.update_layout(yaxis=dict(title='Total Portfolio Closing Value ($)'),
+                          margin=dict(r=0, l=0, b=0, t=66), paper_bgcolor='#f9f9f9',
+                          title="Total Portfolio Closing Daily Value")
+    r_graph.update_layout(yaxis=dict(title='Return on Investment (ROI)'),
+                          margin=dict(r=0, l=0, b=0, t=66), paper_bgcolor='#f9f9f9',
+                          title="Total Portfolio Returns (ROI)")
+    return i_graph, t_graph, r_graph
+
+
 def register_manual(server):
     # TODO: For Next Release
     #  Add a footer, with copyright protection.
@@ -92,6 +110,7 @@ def register_manual(server):
         if not data:
             return px.line()
 
+        portfolio = Portfolio.query.filter_by(user_id=user.id, name=portfolio_name).one_or_none()
         if active_tab == 'tab-2':
             if rows:
                 row_dict = data[rows[0]]
@@ -100,24 +119,15 @@ def register_manual(server):
                             'Value': row_dict['purchase_value'],
                             'Strategy': row_dict['strategy'],
                             'Start Date': row_dict['purchase_date']}
-                values_df = strategy_calculations.get_values_df(row_data, user)
-                trading_decisions_graph = strategy_calculations.make_spy_graph(ticker, values_df)
+                trading_decisions_graph = portfolio_cache.get(
+                    portfolio, ('trade', row_dict['id']),
+                    lambda: strategy_calculations.make_spy_graph(ticker, strategy_calculations.get_values_df(row_data, user)))
                 return trading_decisions_graph
             return px.line(title='Select a Stock to View Automatic Trading Decisions')
         else:
-            portfolio = Portfolio.query.filter_by(user_id=user.id, name=portfolio_name).one_or_none()
-            all_trades = Trade.query.filter_by(portfolio_id=portfolio.id).all()
-            i_graph, t_graph, r_graph = stock_calculations.plot_stocks(user, all_trades)
-
-            i_graph.update_layout(yaxis=dict(title='Individual Closing Value ($)'),
-                                  margin=dict(r=0, l=0, b=0, t=66), paper_bgcolor='#f9f9f9',
-                                  title="Individual Closing Values")
-            t_graph.update_layout(yaxis=dict(title='Total Portfolio Closing Value ($)'),
-                                  margin=dict(r=0, l=0, b=0, t=66), paper_bgcolor='#f9f9f9',
-                                  title="Total Portfolio Closing Daily Value")
-            r_graph.update_layout(yaxis=dict(title='Return on Investment (ROI)'),
-                                  margin=dict(r=0, l=0, b=0, t=66), paper_bgcolor='#f9f9f9',
-                                  title="Total Portfolio Returns (ROI)")
+            # A refresh that stores new days bumps the version, so it is read before the cache
+            portfolio_values.refresh_values(user, portfolio)
+            i_graph, t_graph, r_graph = portfolio_cache.get(portfolio, 'total', lambda: make_total_graphs(portfolio))
 
         if active_tab == 'tab-1':
             return i_graph
@@ -196,20 +206,10 @@ def register_manual(server):
             purchase_internal = False
         elif source == 'Internal Funds':
             purchase_internal = True
-            all_trades = Trade.query.filter_by(portfolio_id=portfolio.id).all()
-            # all_cash = Dollar.query.filter_by(portfolio_id=portfolio.id).all()
-            if not all_trades:
+            if Trade.query.filter_by(portfolio_id=portfolio.id).first() is None:
                 return "No cash is currently in the portfolio.  Sell portfolio or add more", "danger", True
 
-            cash = 0
-            for trade in all_trades:
-                if trade.sell_date:
-                    if trade.sell_date <= purchase_datetime:
-                        cash += trade.sell_value
-                if trade.purchase_date <= purchase_datetime:
-                    if trade.purchase_internal:
-                        cash += -1 * trade.purchase_value
-
+            cash = cash_ledger.get_cash(portfolio.id, purchase_datetime)
             print(cash)
             if cash < value:
                 return "Only ${:.2f} cash.  Please add more funds.".format(cash), "danger", True
@@ -220,6 +220,10 @@ def register_manual(server):
                       purchase_date=purchase_datetime,
                       purchase_internal=purchase_internal)
         db.session.add(trade)
+        # The ledger entry refers to the trade id
+        db.session.flush()
+        cash_ledger.add_purchase(trade)
+        portfolio_values.invalidate_values(portfolio.id, purchase_datetime)
         db.session.commit()
         return "Portfolio Updated", "success", True
 
@@ -238,7 +242,9 @@ def register_manual(server):
         del_row = data[selected_rows[0]]
 
         trade = Trade.query.filter_by(id=del_row['id']).one_or_none()
+        cash_ledger.delete_trade_entries(trade.id)
         db.session.delete(trade)
+        portfolio_values.invalidate_values(trade.portfolio_id, trade.purchase_date)
         db.session.commit()
         return "Trade Deleted", "success", True
 
@@ -281,6 +287,8 @@ def register_manual(server):
         trade.sell_value = sell_value
         print(sell_value)
 
+        cash_ledger.add_sale(trade)
+        portfolio_values.invalidate_values(trade.portfolio_id, trade.sell_date)
         db.session.commit()
         return "Stock Sold", "success", True
 
@@ -302,6 +310,7 @@ def register_manual(server):
             return "Strategies can only track stocks purchased with external funds", "danger", True
         trade = Trade.query.filter_by(id=sell_row['id']).one_or_none()
         trade.strategy = strategy
+        portfolio_values.invalidate_values(trade.portfolio_id, trade.purchase_date)
         db.session.commit()
         return "Strategy Updated", "success", True
 
@@ -325,6 +334,9 @@ def register_manual(server):
                 if trades_list:
                     for trade in trades_list:
                         db.session.delete(trade)
+                cash_ledger.delete_entries(is_portfolio.id)
+                portfolio_values.delete_values(is_portfolio.id)
+                portfolio_cache.drop(is_portfolio)
                 db.session.delete(is_portfolio)
                 db.session.commit()
                 return "Portfolio Removed!", "success", True
@@ -0,0 +1,65 @@
+from trades import db
+from trades.models import Trade, Portfolio, Dollar
+
+
+# The dollars table is the cash ledger of every portfolio, written in the same session as the
+# trade change it records, so the callers commit both together.  Every purchase with internal funds
+# and every sale has one entry, so a portfolio traded before the ledger existed is missing some and
+# get_cash rebuilds its ledger before reading it.  All ledgers can also be built at once with
+#   python -m trades.rebuild_cash_ledgers
+def add_purchase(trade):
+    # Purchases with external funds bring their own money and never touch the cash
+    if trade.purchase_internal:
+        db.session.add(Dollar(portfolio_id=trade.portfolio_id,
+                              trade_id=trade.id,
+                              purchase_date=trade.purchase_date,
+                              value=-1 * trade.purchase_value,
+                              invested=True))
+
+
+def add_sale(trade):
+    db.session.add(Dollar(portfolio_id=trade.portfolio_id,
+                          trade_id=trade.id,
+                          purchase_date=trade.sell_date,
+                          value=trade.sell_value,
+                          de_invested=True))
+
+
+def delete_trade_entries(trade_id):
+    Dollar.query.filter_by(trade_id=trade_id).delete()
+
+
+def delete_entries(portfolio_id):
+    Dollar.query.filter_by(portfolio_id=portfolio_id).delete()
+
+
+def count_missing_entries(portfolio_id):
+    purchases = Trade.query.filter_by(portfolio_id=portfolio_id, purchase_internal=True).count()
+    sales = Trade.query.filter(Trade.portfolio_id == portfolio_id, Trade.sell_date.isnot(None)).count()
+    entries = Dollar.query.filter(Dollar.portfolio_id == portfolio_id, Dollar.trade_id.isnot(None)).count()
+    return purchases + sales - entries
+
+
+def get_cash(portfolio_id, date):
+    if count_missing_entries(portfolio_id):
+        # Committed on its own, the purchase being checked may still be refused
+        rebuild_ledger(portfolio_id)
+        db.session.commit()
+    # The cash after every entry up to and including date, summed within the index range
+    return db.session.query(db.func.coalesce(db.func.sum(Dollar.value), 0.0)) \
+        .filter(Dollar.portfolio_id == portfolio_id, Dollar.purchase_date <= date).scalar()
+
+
+def rebuild_ledger(portfolio_id):
+    delete_entries(portfolio_id)
+    for trade in Trade.query.filter_by(portfolio_id=portfolio_id).all():
+        add_purchase(trade)
+        if trade.sell_date:
+            add_sale(trade)
+
+
+def rebuild_all_ledgers():
+    for portfolio in Portfolio.query.all():
+        print(f"Rebuilding the cash ledger of portfolio {portfolio.id}")
+        rebuild_ledger(portfolio.id)
+        db.session.commit()
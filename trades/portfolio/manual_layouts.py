@@ -7,7 +7,6 @@ import plotly.express as px
 from dash_table.Format import Format
 
 from trades.portfolio import stock_calculations
-from trades.strategy import get_strategies
 
 
 def make_manual_dashboard():
@@ -276,6 +275,8 @@ def make_strategy_controls():
         dbc.Button(id='strategy_input', children='Update Strategy', block=True)
     ])
 
+    # trades.strategy imports this module through strategy_calculations, so it is imported here
+    from trades.strategy import get_strategies
     strategy_list = get_strategies()
 
     strategy_dropdown = dbc.FormGroup([
@@ -360,6 +361,7 @@ def make_sell_layout():
                                style={"position": "fixed", "top": 0})
 
 
+    from trades.strategy import get_strategies
     strategies = get_strategies()
 
 
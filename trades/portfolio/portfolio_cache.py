@@ -0,0 +1,38 @@
+from trades import db
+from trades.models import Portfolio
+from trades.prices import price_store
+from trades.ttl_cache import TtlCache
+
+PORTFOLIO_CACHE_ENTRIES = 64
+
+
+class PortfolioCache:
+    # Keeps what the portfolio tabs compute, keyed by the portfolio's cache_id, its version and the
+    # name of the result, so switching tabs reuses the figures of the last change.  Every change to
+    # a portfolio's trades or stored values bumps the version in the database, so no worker serves a
+    # result from before the change.  cache_id is never reused, so a new portfolio that gets the id
+    # of a deleted one starts without entries.  Entries also expire after ttl, which brings a new
+    # day into results that no values refresh covers.
+    def __init__(self, max_entries=PORTFOLIO_CACHE_ENTRIES, ttl=price_store.INTRADAY_TTL):
+        self.results = TtlCache(max_entries, ttl)
+
+    def get(self, portfolio, name, make_value):
+        return self.results.get((get_cache_id(portfolio), portfolio.version or 0, name), make_value)
+
+    def drop(self, portfolio):
+        cache_id = get_cache_id(portfolio)
+        self.results.drop(lambda key: key[0] == cache_id)
+
+
+def get_cache_id(portfolio):
+    # Portfolios created before cache_id existed keep their id, which no new portfolio is keyed by
+    return portfolio.cache_id or portfolio.id
+
+
+def bump_version(portfolio_id):
+    # Committed by the caller with the change it marks
+    Portfolio.query.filter_by(id=portfolio_id).update({'version': db.func.coalesce(Portfolio.version, 0) + 1},
+                                                      synchronize_session=False)
+
+
+portfolio_cache = PortfolioCache()
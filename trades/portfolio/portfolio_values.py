@@ -0,0 +1,131 @@
+import json
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.exc import IntegrityError
+
+from trades import db
+from trades.models import User, Trade, Portfolio, PortfolioValue
+from trades.portfolio import stock_calculations
+from trades.portfolio.portfolio_cache import bump_version
+from trades.prices import price_store
+
+# Stored values are reused this long before the last day is refreshed, like today's price bar
+VALUES_TTL = price_store.INTRADAY_TTL
+LEDGER_COLUMNS = ['cash', 'total', 'invested', 'roi', 'strategic']
+
+
+# portfolio_values keeps one row per day of each portfolio's valuation, so the charts read stored
+# rows instead of pricing every trade again.  A change to a trade deletes the rows from the first
+# day it affects, and a refresh recomputes from the last stored day on, which also replaces that
+# day's row while its price bar can still move.  The strategic values continue each lot's backtest
+# from the state stored with the day before, so lots are only backtested from their purchase date
+# when no earlier row holds their state.  Refreshes run when a chart is drawn, at most once per
+# VALUES_TTL, and for every portfolio from
+#   python -m trades.refresh_portfolio_values
+# The callers of invalidate_values commit it with the change that caused it.  Both bump the
+# portfolio's version, which keys the cached figures in portfolio_cache.
+def invalidate_values(portfolio_id, first_date):
+    PortfolioValue.query.filter(PortfolioValue.portfolio_id == portfolio_id,
+                                PortfolioValue.date >= first_date).delete()
+    Portfolio.query.filter_by(id=portfolio_id).update({'values_refreshed_at': None})
+    bump_version(portfolio_id)
+
+
+def invalidate_strategy_values(user, strategy_name):
+    # Every trade following the strategy changes from its purchase date
+    rows = db.session.query(Trade.portfolio_id, db.func.min(Trade.purchase_date)) \
+        .join(Portfolio, Portfolio.id == Trade.portfolio_id) \
+        .filter(Portfolio.user_id == user.id, Trade.strategy == strategy_name) \
+        .group_by(Trade.portfolio_id).all()
+    for portfolio_id, first_date in rows:
+        invalidate_values(portfolio_id, first_date)
+
+
+def delete_values(portfolio_id):
+    PortfolioValue.query.filter_by(portfolio_id=portfolio_id).delete()
+
+
+def is_fresh(portfolio, now_time):
+    return portfolio.values_refreshed_at is not None and \
+        portfolio.values_refreshed_at > now_time - timedelta(seconds=VALUES_TTL)
+
+
+def make_value_rows(portfolio_id, df, strategic_df, states_df):
+    lot_columns = [column for column in df.columns if column not in LEDGER_COLUMNS]
+    rows = []
+    for date, lot_values, ledger_values, strategic_values, states in zip(
+            df.index, df[lot_columns].values, df[LEDGER_COLUMNS].values, strategic_df.values, states_df.values):
+        positions = {str(trade_id): float(value) for trade_id, value in zip(lot_columns, lot_values)
+                     if not np.isnan(value)}
+        strategic_positions = {str(trade_id): [float(value), int(state)]
+                               for trade_id, value, state in zip(strategic_df.columns, strategic_values, states)
+                               if not np.isnan(value)}
+        row = {'portfolio_id': portfolio_id,
+               'date': date.to_pydatetime(),
+               'positions': json.dumps(positions),
+               'strategic_positions': json.dumps(strategic_positions)}
+        for column, value in zip(LEDGER_COLUMNS, ledger_values):
+            row[column] = None if np.isnan(value) else float(value)
+        rows.append(row)
+    return rows
+
+
+def refresh_values(user, portfolio, force=False):
+    now_time = datetime.now()
+    if not force and is_fresh(portfolio, now_time):
+        return
+
+    all_trades = Trade.query.filter_by(portfolio_id=portfolio.id).all()
+    last_rows = PortfolioValue.query.filter_by(portfolio_id=portfolio.id) \
+        .order_by(PortfolioValue.date.desc()).limit(2).all()
+    if not all_trades:
+        delete_values(portfolio.id)
+        df = pd.DataFrame(columns=LEDGER_COLUMNS)
+        strategic_df = states_df = pd.DataFrame()
+    elif not last_rows:
+        df, strategic_df, states_df = stock_calculations.get_portfolio_values(user, all_trades)
+    else:
+        # The last day is recomputed, so the lots continue from the day before it
+        resume = read_strategic_state(last_rows[1]) if len(last_rows) > 1 else None
+        df, strategic_df, states_df = stock_calculations.get_portfolio_values(
+            user, all_trades, last_rows[0].date, resume)
+        PortfolioValue.query.filter(PortfolioValue.portfolio_id == portfolio.id,
+                                    PortfolioValue.date >= last_rows[0].date).delete()
+
+    db.session.bulk_insert_mappings(PortfolioValue,
+                                    make_value_rows(portfolio.id, df.astype(float), strategic_df, states_df))
+    portfolio.values_refreshed_at = now_time
+    bump_version(portfolio.id)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # Another worker stored the same days first
+        db.session.rollback()
+
+
+def read_strategic_state(row):
+    # Rows stored before strategic_positions existed hold no state, so their lots start over
+    if not row.strategic_positions:
+        return None
+    return {int(trade_id): (row.date, value, state)
+            for trade_id, (value, state) in json.loads(row.strategic_positions).items()}
+
+
+def read_values(portfolio):
+    # The stored days as get_portfolio_values returns them, lot columns keyed by trade id
+    rows = PortfolioValue.query.filter_by(portfolio_id=portfolio.id).order_by(PortfolioValue.date).all()
+    index = pd.DatetimeIndex([row.date for row in rows], name='Date')
+    positions = [{int(trade_id): value for trade_id, value in json.loads(row.positions).items()} for row in rows]
+    lot_df = pd.DataFrame(positions, index=index, dtype=float)
+    ledger_df = pd.DataFrame({column: [getattr(row, column) for row in rows] for column in LEDGER_COLUMNS},
+                             index=index, dtype=float)
+    return pd.concat([lot_df, ledger_df], axis=1)
+
+
+def refresh_all_values():
+    for portfolio in Portfolio.query.all():
+        user = User.query.filter_by(id=portfolio.user_id).one_or_none()
+        print(f"Refreshing the values of portfolio {portfolio.id}")
+        refresh_values(user, portfolio, force=True)
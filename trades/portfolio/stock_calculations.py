@@ -4,10 +4,11 @@ from datetime import timedelta
 
 import numpy as np
 import pandas as pd
-import yfinance as yf
 import plotly.express as px
 import plotly.graph_objs as go
 
+from trades.prices.price_cache import price_cache
+from trades.prices.providers import PRICE_FIELDS
 from trades.strategy import strategy_calculations
 from trades.strategy.strategy_calculations import signal_to_dict
 
@@ -23,30 +24,9 @@ def get_securities_list():
 def get_yahoo_stock_data(ticker_symbol, start_time, end_time):
     if not ticker_symbol:
         return pd.DataFrame()
-    ticker_symbol_string = make_ticker_string(ticker_symbol)
-    df = pd.DataFrame()
-
-    try:
-        df = yf.download(ticker_symbol_string, start=start_time, end=end_time, group_by="ticker")
-        # print(f"Data found for {ticker_symbol}, {start_time}, {end_time}")
-    except KeyError:
-        print(f"Key Error Caught for {ticker_symbol}, {start_time}, {end_time}")
-    return df
-
-
-def make_ticker_string(ticker_symbol):
-    if len(ticker_symbol) == 0:
-        return ''
-
-    if len(ticker_symbol) == 1:
-        return ticker_symbol[0]
-
-    ticker_symbol_str = ''
-    for ticker in ticker_symbol:
-        ticker_symbol_str += ticker
-        ticker_symbol_str += ' '
-
-    return ticker_symbol_str
+    # Served from memory when possible, then from the local price store, which downloads
+    # from yahoo only what it does not have
+    return price_cache.get_prices(ticker_symbol, start_time, end_time)
 
 
 def make_np_date(date_str):
@@ -63,119 +43,124 @@ def trade_to_dict(trade):
     return trade_dict
 
 
-def get_auto_data(user, trades):
-    data = []
-    for trade in trades:
-        data.append(trade_to_dict(trade))
-
-    df_strat_dict = {}
-    for i,row in enumerate(data):
-        if not row['purchase_internal']:
-            df_strat = pd.DataFrame()
-            value_df = strategy_calculations.get_values_df(row, user)
-            ticker = row['Name']
-            df_strat['strategic'] = value_df['strategic_values']
-            df_strat_dict[ticker+f'-{i}'] = df_strat
-
-    full_strat_df = pd.concat(df_strat_dict, axis=1)
-    full_strat_df['sum'] = full_strat_df[list(full_strat_df.columns)].sum(axis=1)
-
-    return full_strat_df
-
-
-def plot_stocks(user, all_trades):
-    now_time = datetime.now()
-    ticker_list = []
-    purchase_dates = []
-    purchase_values = []
-    purchase_internals = []
-    sell_dates = []
-    sell_values = []
+def get_auto_data(user, trades, resume=None):
+    # The strategic value and state of every lot bought with outside money, columns keyed by trade
+    # id.  resume maps trade ids to the (date, value, state) of a stored day, from which those lots
+    # continue instead of being backtested from their purchase date.
+    resume = resume or {}
+    external = [trade for trade in trades if not trade.purchase_internal]
+    lot_resume = {i: resume[trade.id] for i, trade in enumerate(external) if trade.id in resume}
+    # Valued together by ticker and strategy
+    dates, lots, values_matrix, states_matrix = strategy_calculations.get_lot_values(
+        [trade_to_dict(trade) for trade in external], user, lot_resume)
+
+    index = pd.DatetimeIndex(dates, name='Date')
+    columns = [external[lot].id for lot in lots]
+    return pd.DataFrame(values_matrix, index=index, columns=columns), \
+        pd.DataFrame(states_matrix, index=index, columns=columns)
+
+
+def make_trade_ledger(all_trades, dates):
+    # Cash and invested value on each of dates.  Every trade becomes dated cash and invested
+    # deltas, a sell adds its value to cash on the sell date and a purchase takes its value from
+    # cash (internal funds) or adds it to invested on the purchase date.  Each date then reads the
+    # running sum of the events up to and including that date.
+    event_dates = []
+    cash_deltas = []
+    invested_deltas = []
     for trade in all_trades:
-        ticker_list.append(trade.security)
-        purchase_dates.append(trade.purchase_date)
-        purchase_values.append(trade.purchase_value)
-        purchase_internals.append(trade.purchase_internal)
         if trade.sell_date:
-            sell_dates.append(trade.sell_date)
-            sell_values.append(trade.sell_value)
+            event_dates.append(trade.sell_date)
+            cash_deltas.append(trade.sell_value)
+            invested_deltas.append(0)
+        event_dates.append(trade.purchase_date)
+        if trade.purchase_internal:
+            cash_deltas.append(-1 * trade.purchase_value)
+            invested_deltas.append(0)
         else:
-            sell_dates.append(now_time)
-            sell_values.append(None)
-
-    start_time = min([sti for sti in purchase_dates])
-    end_time = max([eti for eti in sell_dates])
-    full_df = get_yahoo_stock_data(ticker_list, start_time, end_time)
-
-    if len(ticker_list) == 1 or ticker_list.count(ticker_list[0]) == len(ticker_list):
-        print('Modifying yahoo data')
-        new_df = pd.concat({ticker_list[0]: full_df}, axis=1)
-        full_df = new_df
-
-    df_list = []
-    for i, ticker in enumerate(ticker_list):
-        individual_df = pd.DataFrame()
-        purchase_date = make_np_date(purchase_dates[i])
-        sell_date = make_np_date(sell_dates[i])
-
-        individual_df[ticker+f'-{i}'] = full_df.loc[(full_df.index.values >= purchase_date) & (full_df.index.values < sell_date), ticker]['Close'].copy(deep=True)
-        shares = purchase_values[i]/individual_df[ticker+f'-{i}'][0]
-        individual_df[ticker+f'-{i}'] = individual_df[ticker+f'-{i}']*shares
-
-        df_list.append(individual_df)
-
-    df1 = pd.DataFrame()
-    df1['remove'] = full_df[ticker_list[0]]['Close'].copy(deep=True)
-    df = pd.concat([df1, *df_list], axis=1)
-
-    cash_list = []
-    invested_list = []
-    for date in df.index.values:
-        pd_date = pd.to_datetime(date)
-        cash = 0
-        invested = 0
-        for trade in all_trades:
-            if trade.sell_date:
-                # print(trade.sell_date, type(trade.sell_date))
-                # print(pd.to_datetime(date), type(pd.to_datetime(date)))
-                if trade.sell_date <= pd_date:
-                    cash += trade.sell_value
-            if trade.purchase_date <= pd_date:
-                if trade.purchase_internal:
-                    cash += -1 * trade.purchase_value
-                else:
-                    invested += trade.purchase_value
-
-        cash_list.append(cash)
-        invested_list.append(invested)
-
-    df['cash'] = cash_list
-    del df['remove']
+            cash_deltas.append(0)
+            invested_deltas.append(trade.purchase_value)
+
+    event_dates = pd.to_datetime(event_dates).values
+    order = np.argsort(event_dates, kind='stable')
+    cash_totals = np.concatenate([[0], np.cumsum(np.array(cash_deltas, dtype=float)[order])])
+    invested_totals = np.concatenate([[0], np.cumsum(np.array(invested_deltas, dtype=float)[order])])
+    n_events = np.searchsorted(event_dates[order], dates, side='right')
+    return cash_totals[n_events], invested_totals[n_events]
+
+
+def get_portfolio_values(user, all_trades, start_time=None, resume=None):
+    # The daily value of every lot, keyed by trade id, with the cash and invested ledger, the total,
+    # the roi and the strategic value of the externally funded lots.  With start_time only the days
+    # from start_time on are built and only the lots still held then are priced.  The strategic
+    # value has its own days, so the ledger columns are NaN on days without prices and strategic
+    # is NaN on days without a strategic value.  The strategic values and states of the single
+    # lots on the same days are returned next to it, and resume continues lots from them as
+    # get_auto_data does.
+    now_time = datetime.now()
+    if start_time is None:
+        start_time = min(trade.purchase_date for trade in all_trades)
+    end_time = max(trade.sell_date or now_time for trade in all_trades)
+    held_trades = [trade for trade in all_trades if (trade.sell_date or now_time) > start_time]
+
+    df = pd.DataFrame(index=pd.DatetimeIndex([], name='Date'))
+    if held_trades:
+        ticker_list = list(dict.fromkeys(trade.security for trade in held_trades))
+        first_purchase = min(trade.purchase_date for trade in held_trades)
+        full_df = get_yahoo_stock_data(ticker_list, first_purchase, end_time)
+        if len(ticker_list) == 1:
+            full_df = pd.concat({ticker_list[0]: full_df.reindex(columns=PRICE_FIELDS)}, axis=1)
+
+        full_dates = full_df.index.values
+        df = pd.DataFrame(index=full_df.index[full_dates >= make_np_date(start_time)])
+        for trade in held_trades:
+            purchase_date = make_np_date(trade.purchase_date)
+            sell_date = make_np_date(trade.sell_date or now_time)
+            lot_close = full_df.loc[(full_dates >= purchase_date) & (full_dates < sell_date), trade.security]['Close']
+            if lot_close.empty:
+                # No prices for the ticker at all, so the lot has no column
+                continue
+            shares = trade.purchase_value/lot_close.iloc[0]
+            df[trade.id] = lot_close*shares
+
+    cash_array, invested_array = make_trade_ledger(all_trades, df.index.values)
+    df['cash'] = cash_array
     df['total'] = df.sum(axis=1)
-    df['invested'] = invested_list
+    df['invested'] = invested_array
     df['roi'] = df['total']/df['invested']
 
-    # with pd.option_context('display.max_rows', None, 'display.max_columns', None):  # more options can be specified also
-    #     print(df)
+    strategic_df, states_df = get_auto_data(user, all_trades, resume)
+    strategic_df = strategic_df[strategic_df.index >= start_time]
+    df = df.reindex(df.index.union(strategic_df.index))
+    df['strategic'] = pd.Series(np.nansum(strategic_df.values, axis=1), index=strategic_df.index)
+    return df, strategic_df.reindex(df.index), states_df.reindex(df.index)
 
-    full_strat_df = get_auto_data(user, all_trades)
 
+def plot_stocks(all_trades, df):
     if not df.empty:
         i_graph = go.Figure()
-        for i, ticker in enumerate(ticker_list):
-            i_graph.add_trace(go.Scatter(x=df.index, y=df[ticker+f'-{i}'], name=ticker+f'-{i}'))
-        i_graph.add_trace(go.Scatter(x=df.index, y=df['cash'], name='Cash'))
+        for i, trade in enumerate(all_trades):
+            if trade.id in df.columns:
+                lot_values = df[trade.id].dropna()
+                i_graph.add_trace(go.Scatter(x=lot_values.index, y=lot_values, name=trade.security+f'-{i}'))
+        cash = df['cash'].dropna()
+        i_graph.add_trace(go.Scatter(x=cash.index, y=cash, name='Cash'))
         i_graph.update_layout(legend_orientation='h')
 
+        total = df['total'].dropna()
+        strategic = df['strategic'].dropna()
+        invested = df['invested'].dropna()
         t_graph = go.Figure()
-        t_graph.add_trace(go.Scatter(x=df.index, y=df['total'], name='Simple'))
-        t_graph.add_trace(go.Scatter(x=full_strat_df.index, y=full_strat_df['sum'], name='Strategic'))
-        t_graph.add_trace(go.Scatter(x=df.index, y=df['invested'], name='Invested'))
+        t_graph.add_trace(go.Scatter(x=total.index, y=total, name='Simple'))
+        t_graph.add_trace(go.Scatter(x=strategic.index, y=strategic, name='Strategic'))
+        t_graph.add_trace(go.Scatter(x=invested.index, y=invested, name='Invested'))
         t_graph.update_layout(xaxis_title='Date', legend_orientation='h')
 
+        roi = df['roi'].dropna()
+        strategic_roi = (df['strategic']/df['invested']).dropna()
         r_graph = go.Figure()
-        r_graph.add_trace(go.Scatter(x=df.index, y=df['roi'], name='Simple ROI'))
-        r_graph.add_trace(go.Scatter(x=full_strat_df.index, y=full_strat_df['sum']/df['invested'], name='Strategic ROI'))
+        r_graph.add_trace(go.Scatter(x=roi.index, y=roi, name='Simple ROI'))
+        r_graph.add_trace(go.Scatter(x=strategic_roi.index, y=strategic_roi, name='Strategic ROI'))
         r_graph.update_layout(xaxis_title='Date', legend_orientation='h')
 
         return i_graph, t_graph, r_graph
@@ -0,0 +1,113 @@
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from trades.prices import price_store
+
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+class PriceCache:
+    # Keeps recently used price frames in memory, keyed by ticker and [start_date, end_date).
+    # A request is served from any cached range that contains it.  Ranges that reach today
+    # expire after intraday_ttl seconds and the least recently used frames are evicted once
+    # the frames together use more than max_bytes.
+    def __init__(self, max_bytes=CACHE_MAX_BYTES, intraday_ttl=price_store.INTRADAY_TTL):
+        self.max_bytes = max_bytes
+        self.intraday_ttl = intraday_ttl
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get_prices(self, ticker_symbol, start_time, end_time):
+        tickers = list(dict.fromkeys(ticker_symbol))
+        start_date, end_date = self.make_cache_range(start_time, end_time)
+
+        frames = {}
+        missing = []
+        for ticker in tickers:
+            df = self.lookup(ticker, start_date, end_date)
+            if df is None:
+                missing.append(ticker)
+            else:
+                frames[ticker] = df
+
+        if missing:
+            for ticker, df in price_store.get_price_frames(missing, start_date, end_date).items():
+                self.store(ticker, start_date, end_date, df)
+                frames[ticker] = df.copy()
+
+        return price_store.combine_price_frames(tickers, frames)
+
+    def make_cache_range(self, start_time, end_time):
+        # There are no bars after today, so every range ending in the future shares one key
+        start_date, end_date = price_store.make_date_range(start_time, end_time)
+        return start_date, min(end_date, price_store.get_today() + np.timedelta64(1, 'D'))
+
+    def lookup(self, ticker, start_date, end_date):
+        now = time.time()
+        with self.lock:
+            for key, (df, n_bytes, expires) in list(self.entries.items()):
+                if key[0] != ticker or key[1] > start_date or key[2] < end_date:
+                    continue
+                if expires is not None and expires < now:
+                    self.remove(key)
+                    self.expirations += 1
+                    continue
+
+                self.entries.move_to_end(key)
+                self.hits += 1
+                index_values = df.index.values
+                return df.loc[(index_values >= start_date) & (index_values < end_date)].copy()
+
+            self.misses += 1
+            return None
+
+    def store(self, ticker, start_date, end_date, df):
+        n_bytes = int(df.memory_usage(index=True, deep=True).sum())
+        if n_bytes > self.max_bytes:
+            return
+
+        expires = None
+        if end_date > price_store.get_today():
+            expires = time.time() + self.intraday_ttl
+
+        with self.lock:
+            # Ranges inside the new one are no longer needed
+            for key in list(self.entries):
+                if key[0] == ticker and key[1] >= start_date and key[2] <= end_date:
+                    self.remove(key)
+
+            self.entries[(ticker, start_date, end_date)] = (df.copy(), n_bytes, expires)
+            self.total_bytes += n_bytes
+            while self.total_bytes > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    def remove(self, key):
+        df, n_bytes, expires = self.entries.pop(key)
+        self.total_bytes -= n_bytes
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'expirations': self.expirations,
+                    'entries': len(self.entries),
+                    'bytes': self.total_bytes,
+                    'max_bytes': self.max_bytes}
+
+
+price_cache = PriceCache()
@@ -0,0 +1,115 @@
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from trades.prices import price_store
+from trades.prices.providers import PRICE_FIELDS
+
+
+# A panel stores many tickers on one shared trading calendar:
+#   dates.npy     the calendar as datetime64[D]
+#   meta.json     the ticker order of the last axis and the tickers and dates the panel was built for
+#   values.npy    float32 array of shape (fields, dates, tickers), NaN where a ticker has no bar
+# values.npy is memory-mapped read-only, so every process scanning the universe shares its pages
+# and a field or a date range is a view, not a copy.
+class PricePanel:
+    def __init__(self, dates, tickers, values, meta=None):
+        self.dates = dates
+        self.tickers = tickers
+        self.values = values
+        self.meta = meta or {}
+        self.ticker_index = {ticker: i for i, ticker in enumerate(tickers)}
+
+    def get_rows(self, start_time=None, end_time=None):
+        first, last = 0, len(self.dates)
+        if start_time is not None:
+            first = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(start_time).floor('D'), 'D'))
+        if end_time is not None:
+            last = np.searchsorted(self.dates, np.datetime64(pd.Timestamp(end_time).ceil('D'), 'D'))
+        return slice(first, last)
+
+    def get_index(self, rows):
+        return pd.DatetimeIndex(self.dates[rows].astype('datetime64[ns]'), name='Date')
+
+    def get_field(self, field, start_time=None, end_time=None):
+        # dates x tickers, backed by the memory map
+        rows = self.get_rows(start_time, end_time)
+        return pd.DataFrame(self.values[PRICE_FIELDS.index(field), rows, :],
+                            index=self.get_index(rows), columns=self.tickers, copy=False)
+
+    def get_ticker(self, ticker, start_time=None, end_time=None):
+        # The same layout as a single ticker from get_yahoo_stock_data, as a float64 copy
+        rows = self.get_rows(start_time, end_time)
+        df = pd.DataFrame(self.values[:, rows, self.ticker_index[ticker]].T.astype(np.float64),
+                          index=self.get_index(rows), columns=PRICE_FIELDS)
+        return df.dropna(how='all')
+
+
+def get_panel_dir(name):
+    return os.path.join(price_store.PRICE_DIR, price_store.provider.name, 'panels', name)
+
+
+def build_panel(tickers, start_time, end_time, name='sp500'):
+    start_date, end_date = price_store.make_date_range(start_time, end_time)
+    requested = list(dict.fromkeys(tickers))
+    frames = price_store.get_price_frames(requested, start_date, end_date)
+    tickers = [ticker for ticker in requested if ticker in frames]
+    if not tickers:
+        return None
+    ticker_dates = {ticker: frames[ticker].index.values.astype('datetime64[D]') for ticker in tickers}
+    dates = np.unique(np.concatenate(list(ticker_dates.values())))
+
+    panel_dir = get_panel_dir(name)
+    os.makedirs(panel_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=panel_dir, suffix='.tmp')
+    os.close(fd)
+    try:
+        values = np.lib.format.open_memmap(temp_path, mode='w+', dtype=np.float32,
+                                           shape=(len(PRICE_FIELDS), len(dates), len(tickers)))
+        values[:] = np.nan
+        for i, ticker in enumerate(tickers):
+            rows = np.searchsorted(dates, ticker_dates[ticker])
+            values[:, rows, i] = frames[ticker][PRICE_FIELDS].to_numpy(dtype=np.float32).T
+        values.flush()
+        del values
+        os.replace(temp_path, os.path.join(panel_dir, 'values.npy'))
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+    price_store.write_file(os.path.join(panel_dir, 'dates.npy'), lambda f: np.save(f, dates))
+    meta = {'tickers': tickers,
+            'requested': requested,
+            'start_date': str(start_date),
+            'end_date': str(end_date)}
+    price_store.write_file(os.path.join(panel_dir, 'meta.json'), lambda f: f.write(json.dumps(meta).encode()))
+    return load_panel(name)
+
+
+def load_panel(name='sp500'):
+    panel_dir = get_panel_dir(name)
+    try:
+        dates = np.load(os.path.join(panel_dir, 'dates.npy'))
+        with open(os.path.join(panel_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        values = price_store.map_array(os.path.join(panel_dir, 'values.npy'))
+    except (OSError, ValueError):
+        return None
+    if values.shape != (len(PRICE_FIELDS), len(dates), len(meta['tickers'])):
+        # Caught while the panel was being rebuilt
+        return None
+    return PricePanel(dates, meta['tickers'], values, meta)
+
+
+def get_panel(tickers, start_time, end_time, name='sp500'):
+    # Reuses the stored panel when it was built for these tickers and dates, otherwise rebuilds it
+    panel = load_panel(name)
+    start_date, end_date = price_store.make_date_range(start_time, end_time)
+    if panel is not None and set(tickers) <= set(panel.meta['requested']):
+        if np.datetime64(panel.meta['start_date']) <= start_date and np.datetime64(panel.meta['end_date']) >= end_date:
+            return panel
+    return build_panel(tickers, start_time, end_time, name)
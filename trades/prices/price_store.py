@@ -0,0 +1,266 @@
+import fcntl
+import json
+import os
+import tempfile
+import time
+from contextlib import contextmanager, ExitStack
+
+import numpy as np
+import pandas as pd
+
+from trades import PROJECT_ROOT
+from trades.prices.providers import PRICE_FIELDS, combine_frames, make_provider
+
+PRICE_DIR = os.path.join(PROJECT_ROOT, 'assets', 'prices')
+INTRADAY_TTL = 15 * 60
+LOAD_RETRIES = 5
+LOAD_RETRY_SECONDS = 0.01
+
+# Each provider keeps its own store, so fixture data never mixes with downloaded prices
+provider = make_provider()
+
+
+# Each ticker is stored as three files in its own directory, PRICE_DIR/<provider>/<TICKER>:
+#   dates.npy   trading dates as datetime64[D], sorted (the date index)
+#   values.npy  float64 array of shape (fields, dates), one contiguous row per field
+#   meta.json   the fields, the calendar range [covered_start, covered_end) already downloaded
+#               and when today's bar was last refreshed
+# The directory is shared by every gunicorn worker on the host.  Reads memory-map the arrays
+# without locking.  Downloads and writes hold a per-ticker lock file, so concurrent requests
+# for the same ticker, from threads or other workers, wait for one download and then read it.
+def get_ticker_dir(ticker):
+    return os.path.join(PRICE_DIR, provider.name, ticker.upper())
+
+
+def make_date_range(start_time, end_time):
+    # Whole calendar days, with the end exclusive like yfinance
+    start_date = np.datetime64(pd.Timestamp(start_time).floor('D'), 'D')
+    end_date = np.datetime64(pd.Timestamp(end_time).ceil('D'), 'D')
+    return start_date, end_date
+
+
+def get_today():
+    return np.datetime64(pd.Timestamp.now().floor('D'), 'D')
+
+
+def read_meta(ticker):
+    meta_file = os.path.join(get_ticker_dir(ticker), 'meta.json')
+    if not os.path.isfile(meta_file):
+        return None
+    try:
+        with open(meta_file) as f:
+            meta = json.load(f)
+    except ValueError:
+        return None
+    meta['covered_start'] = np.datetime64(meta['covered_start'], 'D')
+    meta['covered_end'] = np.datetime64(meta['covered_end'], 'D')
+    return meta
+
+
+def is_covered(meta, start_date, end_date):
+    if meta is None:
+        return False
+    today = get_today()
+    if meta['covered_start'] > start_date or meta['covered_end'] < min(end_date, today):
+        return False
+    if end_date <= today:
+        return True
+    # Today's bar is still moving, so it is only reused while the last refresh by any worker is recent
+    return meta.get('refreshed_at', 0) > time.time() - INTRADAY_TTL
+
+
+@contextmanager
+def lock_ticker(ticker):
+    ticker_dir = get_ticker_dir(ticker)
+    os.makedirs(ticker_dir, exist_ok=True)
+    with open(os.path.join(ticker_dir, '.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def map_array(file_path):
+    # Like np.load(file_path, mmap_mode='r'), which opens the file by name again for the map.  A
+    # file replaced in between would pair the old header with the new data, so both come from the
+    # same open file here.
+    with open(file_path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        if 0 in shape:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(f, dtype=dtype, mode='r', shape=shape, offset=f.tell(),
+                         order='F' if fortran_order else 'C')
+
+
+def load_arrays(ticker):
+    ticker_dir = get_ticker_dir(ticker)
+    for attempt in range(LOAD_RETRIES):
+        try:
+            dates = map_array(os.path.join(ticker_dir, 'dates.npy'))
+            values = map_array(os.path.join(ticker_dir, 'values.npy'))
+        except (OSError, ValueError):
+            return None, None
+        if values.ndim == 2 and values.shape[1] == len(dates):
+            return dates, values
+        # Caught between the dates and values writes of another process, which follow each other
+        # within milliseconds.  Stored dates only grow, so a pair of the same length always matches.
+        time.sleep(LOAD_RETRY_SECONDS * (attempt + 1))
+    return None, None
+
+
+def read_prices(ticker, start_date, end_date):
+    dates, values = load_arrays(ticker)
+    if dates is None:
+        return pd.DataFrame()
+
+    first = np.searchsorted(dates, start_date, side='left')
+    last = np.searchsorted(dates, end_date, side='left')
+    df = pd.DataFrame(np.array(values[:, first:last].T),
+                      index=pd.DatetimeIndex(np.array(dates[first:last]).astype('datetime64[ns]'), name='Date'),
+                      columns=PRICE_FIELDS)
+    return df
+
+
+def write_prices(ticker, df, covered_start, covered_end, refreshed_at=0):
+    ticker_dir = get_ticker_dir(ticker)
+    os.makedirs(ticker_dir, exist_ok=True)
+
+    df = df.reindex(columns=PRICE_FIELDS).dropna(how='all')
+    df = df[~df.index.duplicated(keep='last')].sort_index()
+    dates = df.index.values.astype('datetime64[D]')
+    values = np.ascontiguousarray(df.to_numpy(dtype=np.float64).T)
+    meta = {'fields': PRICE_FIELDS,
+            'covered_start': str(covered_start),
+            'covered_end': str(covered_end),
+            'refreshed_at': refreshed_at}
+
+    # Write to temporary files first so readers never see a half written array
+    write_file(os.path.join(ticker_dir, 'dates.npy'), lambda f: np.save(f, dates))
+    write_file(os.path.join(ticker_dir, 'values.npy'), lambda f: np.save(f, values))
+    write_file(os.path.join(ticker_dir, 'meta.json'), lambda f: f.write(json.dumps(meta).encode()))
+
+
+def write_file(file_path, write_function):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(file_path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write_function(f)
+        os.replace(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def download_prices(tickers, start_date, end_date):
+    # None when the download failed, so it is not taken for a range without bars
+    try:
+        df = provider.download(tickers, start_date, end_date)
+    except KeyError:
+        print(f"Key Error Caught for {tickers}, {start_date}, {end_date}")
+        return None
+
+    if df.empty:
+        return {}
+    if len(tickers) == 1:
+        return {tickers[0]: df}
+    return {ticker: df[ticker] for ticker in tickers if ticker in df.columns.get_level_values(0)}
+
+
+def read_all_prices(ticker):
+    dates, values = load_arrays(ticker)
+    if dates is None or len(dates) == 0:
+        return pd.DataFrame()
+    return read_prices(ticker, dates[0], dates[-1] + np.timedelta64(1, 'D'))
+
+
+def get_missing_ranges(meta, start_date, end_date):
+    if meta is None:
+        return {'new': (start_date, end_date)}
+
+    # Only the days before the first or after the last covered day need to come from yahoo
+    missing_ranges = {}
+    if start_date < meta['covered_start']:
+        missing_ranges['head'] = (start_date, meta['covered_start'])
+    if end_date > meta['covered_end']:
+        missing_ranges['tail'] = (meta['covered_end'], end_date)
+    return missing_ranges
+
+
+def update_prices(tickers, start_date, end_date):
+    with ExitStack() as stack:
+        # Sorted so two batches sharing tickers always lock them in the same order
+        for ticker in sorted(tickers):
+            stack.enter_context(lock_ticker(ticker))
+
+        # Whatever was filled while we waited for the locks is not downloaded again
+        metas = {ticker: read_meta(ticker) for ticker in tickers}
+        tickers = [ticker for ticker in tickers if not is_covered(metas[ticker], start_date, end_date)]
+        download_missing_prices(tickers, metas, start_date, end_date)
+
+
+def download_missing_prices(tickers, metas, start_date, end_date):
+    # Tickers missing the same part of their history are downloaded together
+    batches = {'new': {}, 'head': {}, 'tail': {}}
+    for ticker in tickers:
+        for part, missing_range in get_missing_ranges(metas[ticker], start_date, end_date).items():
+            batches[part][ticker] = missing_range
+
+    downloaded = {}
+    for part, missing_ranges in batches.items():
+        if not missing_ranges:
+            continue
+        fetch_start = min(missing_range[0] for missing_range in missing_ranges.values())
+        fetch_end = max(missing_range[1] for missing_range in missing_ranges.values())
+        frames = download_prices(list(missing_ranges), fetch_start, fetch_end)
+        if frames is None:
+            continue
+        # A head or tail that came back without bars, like a weekend or the days before a listing,
+        # is covered all the same, so it is not downloaded again.  A new ticker without any bars
+        # may be mistyped or unavailable, so it is tried again on the next request.
+        for ticker in missing_ranges:
+            df = frames.get(ticker, pd.DataFrame(columns=PRICE_FIELDS)).dropna(how='all')
+            if part != 'new' or not df.empty:
+                downloaded.setdefault(ticker, {})[part] = df
+
+    for ticker, new_frames in downloaded.items():
+        meta = metas[ticker]
+        if meta is None:
+            stored_df = pd.DataFrame(columns=PRICE_FIELDS)
+            covered_start, covered_end = start_date, end_date
+            refreshed_at = 0
+        else:
+            # Coverage only grows on the sides that were downloaded
+            stored_df = read_all_prices(ticker)
+            covered_start = start_date if 'head' in new_frames else meta['covered_start']
+            covered_end = end_date if 'tail' in new_frames else meta['covered_end']
+            refreshed_at = meta.get('refreshed_at', 0)
+        if end_date > get_today() and ('new' in new_frames or 'tail' in new_frames):
+            refreshed_at = time.time()
+
+        # Newly downloaded bars replace stored ones, which refreshes a partial bar from an earlier day
+        merged_df = pd.concat([stored_df, *new_frames.values()])
+        write_prices(ticker, merged_df, covered_start, min(covered_end, get_today()), refreshed_at)
+
+
+def get_price_frames(tickers, start_date, end_date):
+    missing = [ticker for ticker in tickers if not is_covered(read_meta(ticker), start_date, end_date)]
+    if missing:
+        update_prices(missing, start_date, end_date)
+
+    frames = {}
+    for ticker in tickers:
+        df = read_prices(ticker, start_date, end_date)
+        if not df.empty:
+            frames[ticker] = df
+    return frames
+
+
+def combine_price_frames(tickers, frames):
+    # Match the yfinance group_by="ticker" layout in the order the tickers were requested
+    return combine_frames(tickers, {ticker: frames[ticker] for ticker in tickers if ticker in frames})
@@ -0,0 +1,93 @@
+import os
+import zlib
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from trades import PROJECT_ROOT
+
+PRICE_FIELDS = ['Open', 'High', 'Low', 'Close', 'Adj Close', 'Volume']
+
+
+# Every provider returns the same frame as yf.download(..., group_by="ticker"): flat
+# PRICE_FIELDS columns for one ticker and (ticker, field) columns for several, indexed
+# by a DatetimeIndex named Date with the end date exclusive.
+class YahooProvider:
+    name = 'yahoo'
+
+    def download(self, tickers, start_date, end_date):
+        return yf.download(' '.join(tickers), start=str(start_date), end=str(end_date), group_by="ticker")
+
+
+class CsvProvider:
+    # Reads <fixture_dir>/<TICKER>.csv files in the layout written by DataFrame.to_csv
+    name = 'csv'
+
+    def __init__(self, fixture_dir):
+        self.fixture_dir = fixture_dir
+
+    def download(self, tickers, start_date, end_date):
+        frames = {}
+        for ticker in tickers:
+            file = os.path.join(self.fixture_dir, ticker.upper() + '.csv')
+            if not os.path.isfile(file):
+                continue
+            df = pd.read_csv(file, index_col='Date', parse_dates=True)
+            frames[ticker] = df.loc[(df.index >= str(start_date)) & (df.index < str(end_date)), PRICE_FIELDS]
+        return combine_frames(tickers, frames)
+
+
+class SyntheticProvider:
+    # A seeded random walk per ticker on business days.  The walk always starts on the same
+    # date, so a day has the same price whichever range it is requested in.
+    name = 'synthetic'
+    first_date = '1990-01-01'
+
+    def download(self, tickers, start_date, end_date):
+        frames = {}
+        dates = pd.bdate_range(self.first_date, pd.Timestamp(str(end_date)) - pd.Timedelta(days=1), name='Date')
+        in_range = dates >= str(start_date)
+        for ticker in tickers:
+            frames[ticker] = self.make_prices(ticker, dates)[in_range]
+        return combine_frames(tickers, frames)
+
+    def make_prices(self, ticker, dates):
+        random_state = np.random.RandomState(zlib.crc32(ticker.upper().encode()))
+        # One row of draws per day keeps earlier days independent of the range length
+        noise = random_state.standard_normal((len(dates), 4))
+        close = 50 * np.exp(np.cumsum(0.0003 + 0.015 * noise[:, 0]))
+        open_ = close * (1 + 0.005 * noise[:, 1])
+        spread = np.abs(0.01 * noise[:, 2])
+        df = pd.DataFrame({'Open': open_,
+                           'High': np.maximum(open_, close) * (1 + spread),
+                           'Low': np.minimum(open_, close) * (1 - spread),
+                           'Close': close,
+                           'Adj Close': close,
+                           'Volume': np.round(1e6 * np.exp(0.5 * noise[:, 3]))},
+                          index=dates)
+        return df
+
+
+def combine_frames(tickers, frames):
+    if len(tickers) == 1:
+        return frames.get(tickers[0], pd.DataFrame())
+    if not frames:
+        return pd.DataFrame()
+    # Like yfinance, a ticker without data keeps its columns, filled with NaN
+    df = pd.concat(frames, axis=1)
+    return df.reindex(columns=pd.MultiIndex.from_product([tickers, PRICE_FIELDS]))
+
+
+def make_provider(provider_name=None, fixture_dir=None):
+    # Chosen with the PRICE_PROVIDER (yahoo, csv or synthetic) and PRICE_FIXTURE_DIR environment variables
+    provider_name = provider_name or os.environ.get('PRICE_PROVIDER', 'yahoo')
+    if provider_name == 'yahoo':
+        return YahooProvider()
+    if provider_name == 'csv':
+        fixture_dir = fixture_dir or os.environ.get('PRICE_FIXTURE_DIR',
+                                                    os.path.join(PROJECT_ROOT, 'assets', 'fixtures'))
+        return CsvProvider(fixture_dir)
+    if provider_name == 'synthetic':
+        return SyntheticProvider()
+    raise ValueError(f"Unknown price provider {provider_name}")
@@ -0,0 +1,8 @@
+# Rebuilds the cash ledger of every portfolio.  trades.portfolio imports cash_ledger itself, so
+# running that module with -m would load it twice.
+from trades import create_app
+from trades.portfolio.cash_ledger import rebuild_all_ledgers
+
+if __name__ == "__main__":
+    with create_app().app_context():
+        rebuild_all_ledgers()
@@ -0,0 +1,8 @@
+# Refreshes the stored daily values of every portfolio.  trades.portfolio imports portfolio_values
+# itself, so running that module with -m would load it twice.
+from trades import create_app
+from trades.portfolio.portfolio_values import refresh_all_values
+
+if __name__ == "__main__":
+    with create_app().app_context():
+        refresh_all_values()
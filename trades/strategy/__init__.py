@@ -1,7 +1,7 @@
 import json
 from datetime import datetime, timedelta
 
-from dash import dash
+from dash import dash, callback_context
 from dash.dependencies import Output, Input, State
 from flask import session
 import plotly.express as px
@@ -15,8 +15,9 @@ import pandas as pd
 
 from trades import db
 from trades.strategy import strategy_layouts, strategy_calculations
-from trades.strategy.optimize import create_single_solutions
-from trades.portfolio import manual_layouts, stock_calculations
+from trades.strategy import optimize_jobs
+from trades.strategy.signal_cache import signal_cache
+from trades.portfolio import manual_layouts, stock_calculations, portfolio_values
 from trades.models import User, Trade, Portfolio, Dollar, Strategy, Signal
 
 from trades import protect_dash_route
@@ -149,6 +150,7 @@ def register_strategy(server):
                     for signal in signal_list:
                         db.session.delete(signal)
                 db.session.delete(is_strategy)
+                portfolio_values.invalidate_strategy_values(user, strategy_name)
                 db.session.commit()
                 return True, "Strategy Removed!", "success"
 
@@ -269,7 +271,8 @@ def register_strategy(server):
         portfolio_value = 1000
 
         # print(base_time, now_time)
-        values_df = strategy_calculations.get_roi(ticker, base_time, now_time, rules_list, buy_threshold, sell_threshold, portfolio_value)
+        # Date range changes only re-slice the cached signals and rerun the backtest
+        values_df = signal_cache.get_roi(ticker, base_time, now_time, rules_list, buy_threshold, sell_threshold, portfolio_value)
         if values_df.empty:
             return dash.no_update
 
@@ -371,6 +374,7 @@ def register_strategy(server):
                                     percentage = row['Percentage'],
                                     weight = row['Weight'])
                     db.session.add(signal)
+                portfolio_values.invalidate_strategy_values(user, strategy_name)
                 db.session.commit()
                 return "All Signals Saved to Database!", 'success', True
             return "No Signals to save", "warning", True
@@ -388,13 +392,75 @@ def register_strategy(server):
 
     @app.callback(
         [Output('opt_alert', 'is_open'),
-         Output('opt_alert', 'children')],
-        [Input('opt_button', 'n_clicks')]
+         Output('opt_alert', 'children'),
+         Output('opt_alert', 'color'),
+         Output('opt_job', 'children'),
+         Output('opt_interval', 'disabled'),
+         Output('opt_results', 'children')],
+        [Input('opt_button', 'n_clicks'),
+         Input('opt_interval', 'n_intervals'),
+         Input('opt_accept_button', 'n_clicks'),
+         Input('opt_cancel_button', 'n_clicks')],
+        [State('opt_job', 'children'),
+         State('signal_table', 'data'),
+         State('buy_threshold', 'value'),
+         State('sell_threshold', 'value'),
+         State('ticker_input', 'value'),
+         State('optimize-type-radio', 'value'),
+         State('optimize-dates', 'start_date'),
+         State('optimize-dates', 'end_date'),
+         ]
     )
-    def add_row(n_clicks):
-        if n_clicks:
-            return True, "Optimizing Percentages..."
-        return False, ""
+    def run_optimization(n_clicks, n_intervals, accept_clicks, cancel_clicks, job_id, existing_data, buy_threshold,
+                         sell_threshold, ticker_input, optimize_type, optimize_start, optimize_end):
+        triggered = [trigger['prop_id'] for trigger in callback_context.triggered]
+        user_name = session.get('user_name', None)
+
+        if n_clicks and 'opt_button.n_clicks' in triggered:
+            now_time = datetime.strptime(optimize_end[0:10], '%Y-%m-%d')
+            base_time = datetime.strptime(optimize_start[0:10], '%Y-%m-%d')
+            bounds = []
+            for rule in existing_data:
+                lower_bound = rule['Percentage'] * 0.5
+                upper_bound = rule['Percentage'] * 3.0
+                bounds.append((lower_bound, upper_bound))
+            goal = optimize_type
+            job_id = optimize_jobs.submit_job(user_name, existing_data, buy_threshold, sell_threshold, ticker_input,
+                                              base_time, now_time, bounds, goal)
+            return True, "Optimizing Percentages...", 'success', job_id, False, dash.no_update
+
+        if job_id and 'opt_cancel_button.n_clicks' in triggered:
+            optimize_jobs.stop_job(job_id, user_name)
+            return True, "Optimization Cancelled", 'warning', None, True, dash.no_update
+
+        if job_id and 'opt_accept_button.n_clicks' in triggered:
+            job = optimize_jobs.get_job(job_id, user_name)
+            if job is not None and job['status'] == optimize_jobs.RUNNING and 'best_percentages' in job['progress']:
+                # Keep the best percentages found so far and let the worker move on
+                optimize_jobs.stop_job(job_id, user_name)
+                results = {'percentages': job['progress']['best_percentages'],
+                           'performance': job['progress']['best_value']}
+                return True, "Using the Best Percentages So Far", 'success', None, True, json.dumps(results)
+
+        if job_id and ('opt_interval.n_intervals' in triggered or 'opt_accept_button.n_clicks' in triggered):
+            job = optimize_jobs.get_job(job_id, user_name)
+            if job is None:
+                return False, "", 'warning', None, True, dash.no_update
+            if job['status'] == optimize_jobs.QUEUED:
+                return True, "Waiting for the optimizer...", 'success', job_id, False, dash.no_update
+            if job['status'] == optimize_jobs.RUNNING:
+                progress = job['progress']
+                message = f"Optimizing Percentages... {progress['evaluations']}/{progress['n_calls']}"
+                if 'best_value' in progress:
+                    message += f", best score {-progress['best_value']:.3f} after {progress['elapsed']:.0f}s"
+                return True, message, 'success', job_id, False, dash.no_update
+            if job['status'] == optimize_jobs.DONE:
+                return True, "Percentages Optimized!", 'success', None, True, json.dumps(job['results'])
+            if job['status'] == optimize_jobs.CANCELLED:
+                return True, "Optimization Cancelled", 'warning', None, True, dash.no_update
+            return True, "Optimization Failed", 'danger', None, True, dash.no_update
+
+        return False, "", 'success', dash.no_update, True, dash.no_update
 
     @app.callback(
         [Output('signal_table', 'data'),
@@ -405,38 +471,23 @@ def register_strategy(server):
         [Input('save_alert', 'children'),
          Input('strategy_name', 'value'),
          Input('row_alert', 'children'),
-         Input('opt_alert', 'children')],
+         Input('opt_results', 'children')],
         [State('row_alert', 'is_open'),
-         State('opt_alert', 'is_open'),
          State('signal_table', 'data'),
          State('signal_table', 'columns'),
          State('buy_threshold', 'value'),
          State('sell_threshold', 'value'),
          State('ticker_input', 'value'),
-         State('optimize-type-radio', 'value'),
-         State('optimize-dates', 'start_date'),
-         State('optimize-dates', 'end_date'),
          ]
     )
-    def get_data(save_alert, strategy_name, row_children, opt_children, is_rows, is_opt,
-                 existing_data, columns, buy_threshold, sell_threshold, ticker_input,
-                 optimize_type, optimize_start, optimize_end):
-
-        if is_opt:
-            now_time = datetime.strptime(optimize_end[0:10], '%Y-%m-%d')
-            base_time = datetime.strptime(optimize_start[0:10], '%Y-%m-%d')
-            bounds = []
-            for rule in existing_data:
-                lower_bound = rule['Percentage'] * 0.5
-                upper_bound = rule['Percentage'] * 3.0
-                bounds.append((lower_bound, upper_bound))
-            goal = optimize_type
-            results, performance = create_single_solutions(
-                existing_data, buy_threshold, sell_threshold, ticker_input,
-                base_time, now_time, bounds, goal)
-            print(results)
-            for i, row in enumerate(existing_data):
-                row['Percentage'] = results[i]
+    def get_data(save_alert, strategy_name, row_children, opt_results, is_rows,
+                 existing_data, columns, buy_threshold, sell_threshold, ticker_input):
+
+        triggered = [trigger['prop_id'] for trigger in callback_context.triggered]
+        if opt_results and 'opt_results.children' in triggered:
+            results = json.loads(opt_results)['percentages']
+            for row, percentage in zip(existing_data, results):
+                row['Percentage'] = percentage
 
             return existing_data, dash.no_update, dash.no_update, dash.no_update, dash.no_update
 
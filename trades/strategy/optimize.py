@@ -1,14 +1,54 @@
 import os
 import time
+from concurrent.futures import ProcessPoolExecutor
 
-from skopt import gp_minimize
+from skopt import gp_minimize, Optimizer
+from skopt.callbacks import DeadlineStopper
 import numpy as np
 
 # np.random.seed(237)
 import datetime
-from trades.strategy.strategy_calculations import get_roi, get_historic_roi
+from trades.strategy import strategy_calculations, optimize_store
 import pandas as pd
 
+OPTIMIZE_JOBS = os.cpu_count() or 1
+OPTIMIZE_CALLS = 50
+OPTIMIZE_RANDOM_STARTS = 15
+# New evaluations for a rerun that already has the earlier run's points
+WARM_START_CALLS = 10
+# Percentages are evaluated and cached at this many decimals
+OBJECTIVE_DECIMALS = 4
+
+
+class OptimizationSession:
+    # Downloads the price history and indicators once so each objective call only runs the rules and backtest
+    def __init__(self, ticker, base_time, now_time, price_df=None):
+        self.ticker = ticker
+        self.base_time = base_time
+        self.now_time = now_time
+        self.ticker_extra_df = strategy_calculations.get_indicator_data(ticker, base_time, now_time, price_df)
+        self.ticker_full_df = pd.DataFrame()
+        if not self.ticker_extra_df.empty:
+            self.ticker_full_df = strategy_calculations.trim_indicator_data(self.ticker_extra_df, base_time, now_time)
+        # Cached objective values are only reused on exactly the same prices
+        self.data_key = optimize_store.make_data_key(self.ticker_extra_df)
+
+    def get_roi(self, rules_list, buy_threshold, sell_threshold, starting_value):
+        if self.ticker_full_df.empty:
+            return pd.DataFrame()
+        return strategy_calculations.get_indicator_roi(self.ticker_extra_df, self.ticker_full_df, rules_list,
+                                                       buy_threshold, sell_threshold, starting_value)
+
+    def get_batch_roi(self, rules_list, parameter_matrix, starting_value):
+        return strategy_calculations.get_indicator_batch_roi(self.ticker_extra_df, self.ticker_full_df, rules_list,
+                                                             parameter_matrix, starting_value)
+
+    def get_historic_score(self, rules_list, buy_threshold, sell_threshold):
+        values_df = self.get_roi(rules_list, buy_threshold, sell_threshold, 1000)
+        historic_df, strategic_score, total_score = strategy_calculations.get_historic_performance(
+            values_df, self.base_time)
+        return -1*strategic_score/total_score
+
 
 def create_starting_values():
     rules_list = [
@@ -42,47 +82,111 @@ def create_starting_values():
     return rules_list, buy_threshold, sell_threshold, ticker, base_time, now_time, bounds, goal
 
 
-def create_single_solutions(rules_list, buy_threshold, sell_threshold, ticker, base_time, now_time, bounds, goal):
+def create_single_solutions(rules_list, buy_threshold, sell_threshold, ticker, base_time, now_time, bounds, goal,
+                            price_df=None, n_jobs=1, callback=None, n_calls=OPTIMIZE_CALLS, max_seconds=None,
+                            warm_start=False):
+    # With warm_start the run is seeded from, and then saved to, the stored optimization histories
+    strategy_key = optimize_store.make_strategy_key(rules_list, buy_threshold, sell_threshold)
+    x0, y0 = None, None
+    if warm_start:
+        x0, y0 = optimize_store.get_warm_start(strategy_key, ticker, goal, base_time, now_time, bounds)
+
     optimize_weights_function = create_optimize_function(rules_list, buy_threshold, sell_threshold, ticker,
-                                                         base_time, now_time, goal)
-    results, performance = optimize_roi(optimize_weights_function, bounds)
-    print(results)
-    return results, performance
+                                                         base_time, now_time, goal, price_df)
+    res = minimize_roi(optimize_weights_function, bounds, n_jobs, callback, n_calls, max_seconds, x0, y0)
+    if warm_start:
+        optimize_store.save_history(strategy_key, ticker, goal, base_time, now_time, res.x_iters, res.func_vals)
+    print(res.x)
+    return res.x, res.fun
+
+
+class OptimizeObjective:
+    # A plain object rather than a closure so it can be sent to worker processes
+    def __init__(self, session, rules_list, buy_threshold, sell_threshold, goal):
+        self.session = session
+        self.rules_list = rules_list
+        self.buy_threshold = buy_threshold
+        self.sell_threshold = sell_threshold
+        self.goal = goal
+
+    def __call__(self, weight_list):
+        for i, weight in enumerate(weight_list):
+            self.rules_list[i]["Percentage"] = round(float(weight), OBJECTIVE_DECIMALS)
 
+        # Points this run or an earlier one already evaluated come from the objective cache
+        objective_key = optimize_store.make_objective_key(self.session, self.goal, self.rules_list,
+                                                          self.buy_threshold, self.sell_threshold)
+        cached_value = optimize_store.get_objective_value(objective_key)
+        if cached_value is not None:
+            return cached_value
 
-def create_optimize_function(rules_list, buy_threshold, sell_threshold, ticker, base_time, now_time, goal):
-    if goal == "ROI":
-        def optimize_weights(weight_list):
-            for i, weight in enumerate(weight_list):
-                rules_list[i]["Percentage"] = weight
+        if self.goal == "ROI":
             starting_value = 1000
-            values_df = get_roi(ticker, base_time, now_time, rules_list, buy_threshold, sell_threshold, starting_value)
+            values_df = self.session.get_roi(self.rules_list, self.buy_threshold, self.sell_threshold, starting_value)
             roi = -1 * values_df['strategic_values'][-1] / values_df['strategic_values'][0]
             # print(weight_list, roi)
-            return roi
+            value = roi
+        else:
+            opt_score = self.session.get_historic_score(self.rules_list, self.buy_threshold, self.sell_threshold)
+            # print(weight_list, opt_score)
+            value = opt_score
 
-        return optimize_weights
+        optimize_store.save_objective_value(objective_key, value)
+        return value
 
-    elif goal == "Realizations":
-        def optimize_weights(weight_list):
-            for i, weight in enumerate(weight_list):
-                rules_list[i]["Percentage"] = weight
 
-            fig, score_string, score_color, opt_score = get_historic_roi(
-                ticker, base_time, now_time, rules_list, buy_threshold, sell_threshold)
-            # print(weight_list, opt_score)
-            return opt_score
+def create_optimize_function(rules_list, buy_threshold, sell_threshold, ticker, base_time, now_time, goal,
+                             price_df=None):
+    if goal not in ("ROI", "Realizations"):
+        return None
+    session = OptimizationSession(ticker, base_time, now_time, price_df)
+    return OptimizeObjective(session, rules_list, buy_threshold, sell_threshold, goal)
+
 
-        return optimize_weights
+def optimize_roi(optimize_weights_function, bounds, n_jobs=1, callback=None, n_calls=OPTIMIZE_CALLS,
+                 max_seconds=None, x0=None, y0=None):
+    res = minimize_roi(optimize_weights_function, bounds, n_jobs, callback, n_calls, max_seconds, x0, y0)
+    return res.x, res.fun
+
+
+def minimize_roi(optimize_weights_function, bounds, n_jobs=1, callback=None, n_calls=OPTIMIZE_CALLS,
+                 max_seconds=None, x0=None, y0=None):
+    # callback(res, n_evaluated, n_calls) is called with the partial result after each evaluation and
+    # stops the run by returning True.  The run also stops after n_calls evaluations or before it
+    # would overrun max_seconds, and then returns the skopt result with the best point found so far.
+    n_random_starts = min(OPTIMIZE_RANDOM_STARTS, n_calls)
+    n_known = 0
+    if x0 and y0 is None:
+        # Seeds without values are evaluated first, in place of random starts
+        x0 = x0[:n_calls]
+        n_random_starts = max(n_random_starts - len(x0), 0)
+    elif x0:
+        # Points already evaluated on this objective go straight to the model
+        n_random_starts = 0
+        n_known = len(y0)
+        n_calls = min(n_calls, max(n_calls - n_known, WARM_START_CALLS))
+    else:
+        x0, y0 = None, None
+
+    callbacks = []
+    if callback is not None:
+        callbacks.append(lambda res: callback(res, len(res.func_vals) - n_known, n_calls))
+    if max_seconds is not None:
+        callbacks.append(DeadlineStopper(max_seconds))
 
+    if n_jobs > 1:
+        return optimize_roi_parallel(optimize_weights_function, bounds, n_jobs, n_calls, n_random_starts, callbacks,
+                                     x0, y0)
 
-def optimize_roi(optimize_weights_function, bounds):
     tic = time.time()
     res = gp_minimize(optimize_weights_function,  # the function to minimize
                       bounds,  # the bounds on each dimension of x
                       acq_func="EI",  # the acquisition function
-                      n_calls=50,  # the number of evaluations of f
-                      n_random_starts=15,  # the number of random initialization points
+                      n_calls=n_calls,  # the number of evaluations of f
+                      n_random_starts=n_random_starts,  # the number of random initialization points
+                      x0=x0,  # earlier points to start from
+                      y0=y0,  # their values, if already known
+                      callback=callbacks,
                       random_state=1234)  # the random seed
 
     # fig = plot_evaluations(res, bins=20)
@@ -93,7 +197,53 @@ def optimize_roi(optimize_weights_function, bounds):
     toc=time.time()
     # print(f"Optimize Time {toc-tic}")
     # results_dict = {'res_x1': res.x[0], 'res_x2': res.x[1], 'res_x3': res.x[2], 'res_x4': res.x[3], 'res_fun': res.fun}
-    return res.x, res.fun
+    return res
+
+
+worker_objective = None
+
+
+def set_worker_objective(optimize_weights_function):
+    global worker_objective
+    worker_objective = optimize_weights_function
+
+
+def evaluate_worker_objective(weight_list):
+    return worker_objective(weight_list)
+
+
+def optimize_roi_parallel(optimize_weights_function, bounds, n_jobs, n_calls=OPTIMIZE_CALLS,
+                          n_random_starts=OPTIMIZE_RANDOM_STARTS, callbacks=(), x0=None, y0=None):
+    # Each round asks for n_jobs points and evaluates them on a process pool.  The proposals
+    # only depend on the seed and the results told back, so runs stay reproducible.
+    optimizer = Optimizer(bounds,
+                          base_estimator="GP",
+                          acq_func="EI",
+                          n_initial_points=n_random_starts + len(x0 or []),
+                          random_state=1234)
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=set_worker_objective,
+                             initargs=(optimize_weights_function,)) as pool:
+        n_evaluated = 0
+        if x0:
+            # Like gp_minimize, evaluated seeds count towards n_calls and known values do not
+            if y0 is None:
+                y0 = list(pool.map(evaluate_worker_objective, x0))
+                n_evaluated += len(x0)
+            res = optimizer.tell(x0, y0)
+            stops = [callback(res) for callback in callbacks]
+            if any(stops):
+                return res
+        while n_evaluated < n_calls:
+            x_list = optimizer.ask(n_points=min(n_jobs, n_calls - n_evaluated))
+            y_list = list(pool.map(evaluate_worker_objective, x_list))
+            res = optimizer.tell(x_list, y_list)
+            n_evaluated += len(x_list)
+            # Every callback sees each round, like the callback list of gp_minimize
+            stops = [callback(res) for callback in callbacks]
+            if any(stops):
+                break
+
+    return res
 
 
 def combine_df():
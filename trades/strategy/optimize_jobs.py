@@ -0,0 +1,222 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+from datetime import datetime
+
+from trades import PROJECT_ROOT
+from trades.strategy import optimize_store
+from trades.strategy.optimize import create_single_solutions, OPTIMIZE_JOBS, OPTIMIZE_CALLS
+
+JOB_DB = os.path.join(PROJECT_ROOT, 'instance', 'jobs.db')
+POLL_SECONDS = 1.0
+# CPU seconds one job may use, shared out over the OPTIMIZE_JOBS processes evaluating it
+JOB_CPU_SECONDS = 10 * 60
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+CANCELLED = 'cancelled'
+
+# The connection of each thread, with the process that opened it
+connections = threading.local()
+
+
+# Optimizations run in a separate worker process, started with
+#   python -m trades.optimize_worker
+# so the gunicorn workers only insert a job and poll it.  A job moves from queued to running
+# to done or failed, or to cancelled if it is stopped before it starts.  params, progress and
+# results are JSON.  progress is rewritten after every evaluation with the best percentages so
+# far.  stop_requested, the evaluation budget or the time budget end a run early with them.
+def connect():
+    # Strategy pages poll their job every few seconds, so like optimize_store.connect each thread
+    # opens its connection and creates the schema once per process.
+    if getattr(connections, 'pid', None) != os.getpid():
+        connections.connection = make_connection()
+        connections.pid = os.getpid()
+    return connections.connection
+
+
+def make_connection():
+    os.makedirs(os.path.dirname(JOB_DB), exist_ok=True)
+    connection = sqlite3.connect(JOB_DB, timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    connection.execute('''CREATE TABLE IF NOT EXISTS optimize_jobs (
+                              id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              user_name TEXT,
+                              status TEXT NOT NULL,
+                              params TEXT NOT NULL,
+                              progress TEXT,
+                              results TEXT,
+                              error TEXT,
+                              worker_pid INTEGER,
+                              created_at REAL NOT NULL,
+                              started_at REAL,
+                              finished_at REAL,
+                              stop_requested INTEGER NOT NULL DEFAULT 0)''')
+    return connection
+
+
+def submit_job(user_name, rules_list, buy_threshold, sell_threshold, ticker, base_time, now_time, bounds, goal,
+               n_calls=OPTIMIZE_CALLS, max_seconds=None):
+    if max_seconds is None:
+        max_seconds = JOB_CPU_SECONDS / OPTIMIZE_JOBS
+    params = {'rules_list': rules_list,
+              'buy_threshold': buy_threshold,
+              'sell_threshold': sell_threshold,
+              'ticker': ticker,
+              'base_time': base_time.isoformat(),
+              'now_time': now_time.isoformat(),
+              'bounds': bounds,
+              'goal': goal,
+              'n_calls': n_calls,
+              'max_seconds': max_seconds}
+    progress = {'evaluations': 0, 'n_calls': n_calls}
+    connection = connect()
+    # A new submission replaces whatever the user was still optimizing
+    stop_user_jobs(connection, user_name)
+    cursor = connection.execute('INSERT INTO optimize_jobs (user_name, status, params, progress, created_at) '
+                                'VALUES (?, ?, ?, ?, ?)',
+                                (user_name, QUEUED, json.dumps(params), json.dumps(progress), time.time()))
+    return cursor.lastrowid
+
+
+def get_job(job_id, user_name=None):
+    row = connect().execute('SELECT * FROM optimize_jobs WHERE id = ?', (job_id,)).fetchone()
+    if row is None or (user_name is not None and row['user_name'] != user_name):
+        return None
+    job = dict(row)
+    for key in ('params', 'progress', 'results'):
+        if job[key] is not None:
+            job[key] = json.loads(job[key])
+    return job
+
+
+def stop_job(job_id, user_name=None):
+    connection = connect()
+    if user_name is None:
+        connection.execute('UPDATE optimize_jobs SET stop_requested = 1 WHERE id = ?', (job_id,))
+    else:
+        connection.execute('UPDATE optimize_jobs SET stop_requested = 1 WHERE id = ? AND user_name = ?',
+                           (job_id, user_name))
+    cancel_stopped_jobs(connection)
+
+
+def stop_user_jobs(connection, user_name):
+    connection.execute('UPDATE optimize_jobs SET stop_requested = 1 WHERE user_name = ? AND status IN (?, ?)',
+                       (user_name, QUEUED, RUNNING))
+    cancel_stopped_jobs(connection)
+
+
+def cancel_stopped_jobs(connection):
+    # Stopped jobs that no worker has claimed yet never run
+    connection.execute('UPDATE optimize_jobs SET status = ?, finished_at = ? WHERE status = ? AND stop_requested = 1',
+                       (CANCELLED, time.time(), QUEUED))
+
+
+def is_stop_requested(connection, job_id):
+    row = connection.execute('SELECT stop_requested FROM optimize_jobs WHERE id = ?', (job_id,)).fetchone()
+    return row is None or bool(row['stop_requested'])
+
+
+def claim_job(connection):
+    # BEGIN IMMEDIATE takes the write lock, so two workers never claim the same job
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        row = connection.execute('SELECT id FROM optimize_jobs WHERE status = ? ORDER BY id LIMIT 1',
+                                 (QUEUED,)).fetchone()
+        if row is not None:
+            connection.execute('UPDATE optimize_jobs SET status = ?, worker_pid = ?, started_at = ? WHERE id = ?',
+                               (RUNNING, os.getpid(), time.time(), row['id']))
+        connection.execute('COMMIT')
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+    if row is None:
+        return None
+    return get_job(row['id'])
+
+
+def update_job(connection, job_id, **columns):
+    for key in ('progress', 'results'):
+        if key in columns:
+            columns[key] = json.dumps(columns[key])
+    assignments = ', '.join(f'{key} = ?' for key in columns)
+    connection.execute(f'UPDATE optimize_jobs SET {assignments} WHERE id = ?', (*columns.values(), job_id))
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def fail_orphaned_jobs(connection):
+    # Jobs left running by a worker that has since died would otherwise be polled forever
+    rows = connection.execute('SELECT id, worker_pid FROM optimize_jobs WHERE status = ?', (RUNNING,)).fetchall()
+    for row in rows:
+        if row['worker_pid'] is None or not is_process_alive(row['worker_pid']):
+            update_job(connection, row['id'], status=FAILED, error='Worker stopped', finished_at=time.time())
+
+
+def run_job(connection, job):
+    params = job['params']
+    n_calls = params.get('n_calls', OPTIMIZE_CALLS)
+    max_seconds = params.get('max_seconds', JOB_CPU_SECONDS / OPTIMIZE_JOBS)
+    started_at = time.time()
+    cache_stats = optimize_store.get_objective_stats()
+
+    def report_progress(res, n_evaluated, n_planned):
+        progress = {'evaluations': n_evaluated,
+                    'n_calls': n_planned,
+                    'best_value': float(res.fun),
+                    'best_percentages': [float(x) for x in res.x],
+                    'elapsed': time.time() - started_at}
+        update_job(connection, job['id'], progress=progress)
+        return is_stop_requested(connection, job['id'])
+
+    try:
+        results, performance = create_single_solutions(
+            params['rules_list'], params['buy_threshold'], params['sell_threshold'], params['ticker'],
+            datetime.fromisoformat(params['base_time']), datetime.fromisoformat(params['now_time']),
+            [tuple(bound) for bound in params['bounds']], params['goal'],
+            n_jobs=OPTIMIZE_JOBS, callback=report_progress, n_calls=n_calls, max_seconds=max_seconds,
+            warm_start=True)
+    except Exception:
+        traceback.print_exc()
+        update_job(connection, job['id'], status=FAILED, error=traceback.format_exc(), finished_at=time.time())
+        return
+
+    # Counted over the whole cache, so this is exact while one worker runs
+    new_cache_stats = optimize_store.get_objective_stats()
+    cache_hits = new_cache_stats['hits'] - cache_stats['hits']
+    cache_misses = new_cache_stats['misses'] - cache_stats['misses']
+    print(f"Job {job['id']}: {cache_hits} of {cache_hits + cache_misses} evaluations from the objective cache, "
+          f"{new_cache_stats['hit_rate']:.0%} overall")
+
+    update_job(connection, job['id'], status=DONE,
+               results={'percentages': [float(x) for x in results],
+                        'performance': float(performance),
+                        'cache_hits': cache_hits,
+                        'cache_misses': cache_misses},
+               finished_at=time.time())
+
+
+def run_worker():
+    connection = connect()
+    fail_orphaned_jobs(connection)
+    while True:
+        job = claim_job(connection)
+        if job is None:
+            time.sleep(POLL_SECONDS)
+            continue
+        print(f"Optimizing job {job['id']} for {job['params']['ticker']}")
+        run_job(connection, job)
+
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from trades import PROJECT_ROOT
+
+OPTIMIZE_DB = os.path.join(PROJECT_ROOT, 'instance', 'optimize.db')
+WARM_START_SEEDS = 10
+
+# The connection of each thread, with the process that opened it
+connections = threading.local()
+
+
+# optimize_histories keeps every point evaluated by earlier optimizations, so later runs of the same
+# strategy can start from them.  A strategy is identified by its thresholds and every rule field
+# except Percentage, which is what the optimizer varies.  Histories are stored per strategy, ticker,
+# goal and date range.
+# objective_values caches single objective evaluations under a hash of everything the value depends
+# on, including the prices, so any run that revisits a point skips the backtest.
+def connect():
+    # Objective lookups run once per evaluation, so each thread opens its connection and creates the
+    # schema once and then keeps it.  A process forked by the optimizer opens its own, since sqlite
+    # connections must not be shared across a fork.
+    if getattr(connections, 'pid', None) != os.getpid():
+        connections.connection = make_connection()
+        connections.pid = os.getpid()
+    return connections.connection
+
+
+def make_connection():
+    os.makedirs(os.path.dirname(OPTIMIZE_DB), exist_ok=True)
+    connection = sqlite3.connect(OPTIMIZE_DB, timeout=30, isolation_level=None)
+    connection.row_factory = sqlite3.Row
+    # Optimizer processes read and write the cache concurrently
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('''CREATE TABLE IF NOT EXISTS optimize_histories (
+                              strategy_key TEXT NOT NULL,
+                              ticker TEXT NOT NULL,
+                              goal TEXT NOT NULL,
+                              start_date TEXT NOT NULL,
+                              end_date TEXT NOT NULL,
+                              x_iters TEXT NOT NULL,
+                              func_vals TEXT NOT NULL,
+                              updated_at REAL NOT NULL,
+                              PRIMARY KEY (strategy_key, ticker, goal, start_date, end_date))''')
+    connection.execute('''CREATE TABLE IF NOT EXISTS objective_values (
+                              objective_key TEXT PRIMARY KEY,
+                              value REAL NOT NULL,
+                              hits INTEGER NOT NULL DEFAULT 0,
+                              created_at REAL NOT NULL)''')
+    return connection
+
+
+def make_strategy_key(rules_list, buy_threshold, sell_threshold):
+    rules = [{key: value for key, value in rule.items() if key != 'Percentage'} for rule in rules_list]
+    strategy = {'buy_threshold': buy_threshold, 'sell_threshold': sell_threshold, 'rules': rules}
+    return hashlib.sha1(json.dumps(strategy, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def make_data_key(price_df):
+    return hashlib.sha1(pd.util.hash_pandas_object(price_df, index=True).values.tobytes()).hexdigest()
+
+
+def make_objective_key(session, goal, rules_list, buy_threshold, sell_threshold):
+    objective = {'ticker': session.ticker,
+                 'base_time': session.base_time.isoformat(),
+                 'now_time': session.now_time.isoformat(),
+                 'data_key': session.data_key,
+                 'goal': goal,
+                 'buy_threshold': buy_threshold,
+                 'sell_threshold': sell_threshold,
+                 'rules': rules_list}
+    return hashlib.sha1(json.dumps(objective, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def get_objective_value(objective_key):
+    connection = connect()
+    row = connection.execute('SELECT value FROM objective_values WHERE objective_key = ?',
+                             (objective_key,)).fetchone()
+    if row is None:
+        return None
+    connection.execute('UPDATE objective_values SET hits = hits + 1 WHERE objective_key = ?', (objective_key,))
+    return row['value']
+
+
+def save_objective_value(objective_key, value):
+    connect().execute('INSERT OR IGNORE INTO objective_values (objective_key, value, created_at) VALUES (?, ?, ?)',
+                      (objective_key, float(value), time.time()))
+
+
+def get_objective_stats():
+    # Every cached value was computed once, so misses are the number of entries
+    row = connect().execute('SELECT COUNT(*) AS misses, COALESCE(SUM(hits), 0) AS hits '
+                            'FROM objective_values').fetchone()
+    hits, misses = row['hits'], row['misses']
+    return {'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+
+
+def make_date_key(date_time):
+    return date_time.strftime('%Y-%m-%d')
+
+
+def save_history(strategy_key, ticker, goal, base_time, now_time, x_iters, func_vals):
+    # A rerun's history already contains the points it was seeded with, so it replaces the old one
+    x_iters = [[float(x) for x in point] for point in x_iters]
+    func_vals = [float(y) for y in func_vals]
+    connect().execute('INSERT OR REPLACE INTO optimize_histories VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                      (strategy_key, ticker, goal, make_date_key(base_time), make_date_key(now_time),
+                       json.dumps(x_iters), json.dumps(func_vals), time.time()))
+
+
+def is_in_bounds(point, bounds):
+    return len(point) == len(bounds) and all(low <= x <= high for x, (low, high) in zip(point, bounds))
+
+
+def get_warm_start(strategy_key, ticker, goal, base_time, now_time, bounds):
+    # Returns (x0, y0) for the optimizer.  A run on the same date range reuses its evaluated points
+    # and their values.  Otherwise the best points from the most overlapping earlier range are
+    # returned without values, to be evaluated again on the new range in place of random starts.
+    start_date, end_date = make_date_key(base_time), make_date_key(now_time)
+    rows = connect().execute('SELECT * FROM optimize_histories '
+                             'WHERE strategy_key = ? AND ticker = ? AND goal = ? '
+                             'AND start_date < ? AND end_date > ?',
+                             (strategy_key, ticker, goal, end_date, start_date)).fetchall()
+    if not rows:
+        return None, None
+
+    def get_overlap_days(row):
+        first = datetime.strptime(max(row['start_date'], start_date), '%Y-%m-%d')
+        last = datetime.strptime(min(row['end_date'], end_date), '%Y-%m-%d')
+        return (last - first).days
+
+    same_range = [row for row in rows if row['start_date'] == start_date and row['end_date'] == end_date]
+    row = same_range[0] if same_range else max(rows, key=get_overlap_days)
+    points = [(x, y) for x, y in zip(json.loads(row['x_iters']), json.loads(row['func_vals']))
+              if is_in_bounds(x, bounds)]
+    if not points:
+        return None, None
+    if same_range:
+        return [x for x, y in points], [y for x, y in points]
+
+    points.sort(key=lambda point: point[1])
+    return [x for x, y in points[:WARM_START_SEEDS]], None
@@ -0,0 +1,59 @@
+import datetime
+import json
+
+import numpy as np
+import pandas as pd
+
+from trades.prices import price_store
+from trades.portfolio import stock_calculations
+from trades.strategy import strategy_calculations
+from trades.ttl_cache import TtlCache
+
+SIGNAL_HISTORY_START = datetime.datetime(1990, 1, 1)
+SIGNAL_CACHE_ENTRIES = 32
+
+
+class SignalCache:
+    # Keeps the indicators and rule sums of a ticker's whole price history for each rule set, so
+    # a new date range is only a slice and a backtest.  Thresholds only enter the backtest, so they
+    # are not part of the key.  Entries expire with the intraday bar they include and the least
+    # recently used rule sets are dropped after max_entries.
+    def __init__(self, max_entries=SIGNAL_CACHE_ENTRIES, intraday_ttl=price_store.INTRADAY_TTL):
+        self.signals = TtlCache(max_entries, intraday_ttl)
+
+    def get_signals(self, ticker, rules_list):
+        key = (ticker, json.dumps(rules_list, sort_keys=True, default=str))
+        return self.signals.get(key, lambda: self.make_signals(ticker, rules_list))
+
+    def make_signals(self, ticker, rules_list):
+        now_time = datetime.datetime.now() + datetime.timedelta(days=1)
+        signal_df = strategy_calculations.get_indicator_data(ticker, SIGNAL_HISTORY_START, now_time)
+        if signal_df.empty:
+            return signal_df
+        all_days = signal_df.index.values
+        rule_df = strategy_calculations.make_decisions(signal_df, all_days, all_days, rules_list)
+        signal_df['sum'] = rule_df['sum'].values
+        return signal_df
+
+    def get_roi(self, ticker, base_time, now_time, rules_list, buy_threshold, sell_threshold, starting_value):
+        # The same frame as strategy_calculations.get_roi over [base_time, now_time)
+        signal_df = self.get_signals(ticker, rules_list)
+        if signal_df.empty:
+            return pd.DataFrame()
+        index_values = signal_df.index.values
+        first = np.searchsorted(index_values, stock_calculations.make_np_date(base_time))
+        last = np.searchsorted(index_values, np.datetime64(now_time.strftime('%Y-%m-%d')))
+        if first >= last:
+            return pd.DataFrame()
+
+        values_df = signal_df.iloc[first:last].copy()
+        simple_values, strategic_values, decisions, states = strategy_calculations.run_backtest(
+            values_df['sum'].values, values_df['Close'].values, buy_threshold, sell_threshold, starting_value)
+        values_df.loc[:, "simple_values"] = simple_values
+        values_df.loc[:, "strategic_values"] = strategic_values
+        values_df.loc[:, "strategic_decisions"] = decisions
+        values_df.loc[:, "strategic_state"] = states
+        return values_df
+
+
+signal_cache = SignalCache()
@@ -1,7 +1,6 @@
 import cProfile
 import datetime
 import io
-import os
 import pstats
 
 from trades.portfolio import stock_calculations
@@ -16,6 +15,17 @@ import numpy as np
 import scipy
 
 
+BUY = 1
+HOLD = 0
+SELL = -1
+DECISION_LABELS = {BUY: 'Buy', HOLD: 'Hold', SELL: 'Sell'}
+
+INVESTED = 1
+CASH = 0
+# Relative difference below which a strategic and a simple roi count as the same
+ROI_RTOL = 1e-9
+
+
 def make_np_date(date_str):
     np_date = np.array(pd.to_datetime(date_str, format='%Y-%m-%d'), dtype=np.datetime64)
     return np_date
@@ -66,45 +76,25 @@ def make_portfolio_graph(strategic_df, dca_df, weekly_roi_radio):
         return portfolio_value
 
 
-def get_historic_roi(ticker, start_date, end_date, rules_list, buy_threshold, sell_threshold):
-    base_time = start_date
-    now_time = end_date
-    interval = 1
-    day_step = 30
+def get_historic_roi(ticker, start_date, end_date, rules_list, buy_threshold, sell_threshold, intervals=(1,),
+                     day_steps=(30,)):
     portfolio_value = 1000
-    values_df = get_roi(ticker, base_time, now_time, rules_list, buy_threshold, sell_threshold, portfolio_value)
-    historic_performance = []
-    last_day = base_time
+    values_df = get_roi(ticker, start_date, end_date, rules_list, buy_threshold, sell_threshold, portfolio_value)
+    historic_df, strategic_score, total_score = get_historic_performance(values_df, start_date, intervals, day_steps)
 
-    strategic_score = 0
-    total_score = 0
-    for day in values_df.index:
-        if (day-last_day).days > day_step:
-            start_time = day
-            end_time = start_time + datetime.timedelta(days=interval*365)
-            if values_df.index[-1] > end_time:
-                interval_df = values_df.iloc[(values_df.index >= start_time) & (values_df.index <= end_time)]
-                simple_roi = interval_df['simple_values'].iloc[-1]/interval_df['simple_values'][0]
-                historic_performance.append([start_time, end_time, simple_roi, 'simple', interval])
-                strategic_roi = interval_df['strategic_values'].iloc[-1]/interval_df['strategic_values'].iloc[0]
-                historic_performance.append([start_time, end_time, strategic_roi, 'strategic', interval])
-                if strategic_roi > simple_roi:
-                    strategic_score += 1
-                    total_score += 1
-                else:
-                    total_score += 1
-
-                last_day = day
-
-    historic_array = np.array(historic_performance)
-    historic_df = pd.DataFrame.from_records(historic_array)
-    historic_df.columns = ['start_time', 'end_time', 'roi', 'strategy', 'interval']
-    fig = px.scatter(historic_df, x = 'start_time', y='roi', color='strategy', marginal_y='box')
+    if len(intervals) > 1:
+        fig = px.scatter(historic_df, x='start_time', y='roi', color='strategy', facet_row='interval')
+    else:
+        fig = px.scatter(historic_df, x = 'start_time', y='roi', color='strategy', marginal_y='box')
     fig.update_layout(clickmode='event')
     fig.update_layout(yaxis=dict(title='Return on Investment (ROI)'),
                       xaxis=dict(title='Start Date'))
 
     score_string = f"Improved {strategic_score}/{total_score} realizations"
+    if len(intervals) > 1:
+        interval_scores = get_historic_scores(historic_df)
+        score_string += " (" + ", ".join(f"{interval} yr: {row.strategic_score}/{row.total_score}"
+                                         for interval, row in interval_scores.iterrows()) + ")"
     if strategic_score/total_score < 0.5:
         score_color = 'danger'
     elif strategic_score/total_score < 0.75:
@@ -116,29 +106,165 @@ def get_historic_roi(ticker, start_date, end_date, rules_list, buy_threshold, se
     return fig, score_string, score_color, -1*strategic_score/total_score
 
 
-def get_roi(ticker, base_time, now_time, rules_list, buy_threshold, sell_threshold, starting_value):
-    early_time = base_time-datetime.timedelta(days=365)
-    ticker_extra_df = stock_calculations.get_yahoo_stock_data([ticker], early_time.strftime("%Y-%m-%d"), now_time.strftime('%Y-%m-%d'))
+def get_historic_performance(values_df, start_date, intervals=(1,), day_steps=(30,)):
+    # intervals are holding periods in years, each paired with the day step between its window
+    # starts (a single day step applies to every interval).  All windows of all intervals are read
+    # from the one backtest in values_df, and the scores count windows over every interval.
+    historic_columns = ['start_time', 'end_time', 'roi', 'strategy', 'interval']
+    if len(day_steps) == 1:
+        day_steps = list(day_steps) * len(intervals)
+    if len(day_steps) != len(intervals):
+        raise ValueError(f"Got {len(day_steps)} day steps for {len(intervals)} intervals, expected 1 or {len(intervals)}")
+    if values_df.empty:
+        return pd.DataFrame(columns=historic_columns), 0, 0
+
+    days = values_df.index.values
+    simple_values = values_df['simple_values'].to_numpy()
+    strategic_values = values_df['strategic_values'].to_numpy()
+    strategic_score = 0
+    total_score = 0
+    interval_frames = []
+    for interval, day_step in zip(intervals, day_steps):
+        starts, ends = get_window_indices(days, start_date, interval, day_step)
+        simple_rois = simple_values[ends]/simple_values[starts]
+        strategic_rois = strategic_values[ends]/strategic_values[starts]
+        strategic_score += int(np.sum(is_improved(strategic_rois, simple_rois)))
+        total_score += len(starts)
+
+        # One simple and one strategic row per window
+        start_times = days[starts]
+        interval_frames.append(pd.DataFrame({
+            'start_time': np.repeat(start_times, 2),
+            'end_time': np.repeat(start_times + get_interval_length(interval), 2),
+            'roi': np.column_stack([simple_rois, strategic_rois]).ravel(),
+            'strategy': np.tile(['simple', 'strategic'], len(starts)),
+            'interval': interval},
+            columns=historic_columns))
+
+    historic_df = pd.concat(interval_frames, ignore_index=True)
+    return historic_df, strategic_score, total_score
+
+
+def get_historic_scores(historic_df):
+    # Improved and total windows for each interval of a get_historic_performance frame
+    simple_df = historic_df[historic_df['strategy'] == 'simple'].reset_index(drop=True)
+    strategic_df = historic_df[historic_df['strategy'] == 'strategic'].reset_index(drop=True)
+    improved = pd.Series(is_improved(strategic_df['roi'].to_numpy(dtype=float), simple_df['roi'].to_numpy(dtype=float)))
+    return pd.DataFrame({'strategic_score': improved.groupby(simple_df['interval']).sum().astype(int),
+                         'total_score': simple_df.groupby('interval').size()})
+
+
+def is_improved(strategic_rois, simple_rois):
+    # A window where the strategy stays invested has the same roi as buying and holding, up to the
+    # rounding of the backtest's products, so only a difference beyond that counts
+    return (strategic_rois > simple_rois) & ~np.isclose(strategic_rois, simple_rois, rtol=ROI_RTOL, atol=0)
+
+
+def get_interval_length(interval):
+    # An interval in years as whole days, rounded so that e.g. half a year is 183 days, not 182
+    return np.timedelta64(int(np.floor(interval*365 + 0.5)), 'D')
+
+
+def get_window_indices(days, start_date, interval, day_step):
+    # A window starts on the first day more than day_step days after the previous window's start,
+    # the first one counted from start_date, and ends on the last day within interval years of its
+    # start.  Only windows ending before the last day are kept.
+    step = np.timedelta64(day_step + 1, 'D')
+    next_starts = np.searchsorted(days, days + step)
+    starts = []
+    start = np.searchsorted(days, np.datetime64(start_date) + step)
+    while start < len(days):
+        starts.append(start)
+        start = next_starts[start]
+    starts = np.array(starts, dtype=int)
+
+    end_times = days[starts] + get_interval_length(interval)
+    starts = starts[end_times < days[-1]]
+    ends = np.searchsorted(days, end_times[:len(starts)], side='right') - 1
+    return starts, ends
+
+
+def get_roi(ticker, base_time, now_time, rules_list, buy_threshold, sell_threshold, starting_value, price_df=None):
+    ticker_extra_df = get_indicator_data(ticker, base_time, now_time, price_df)
     if ticker_extra_df.empty:
         return pd.DataFrame()
+    ticker_full_df = trim_indicator_data(ticker_extra_df, base_time, now_time)
+
+    # Calculate the portfolio performance and create data frames
+    return get_indicator_roi(ticker_extra_df, ticker_full_df, rules_list, buy_threshold, sell_threshold, starting_value)
+
+
+def get_batch_roi(ticker, base_time, now_time, rules_list, parameter_matrix, starting_value, price_df=None):
+    # Backtests K parameter sets over one download.  Each row of parameter_matrix is
+    # [percentage of each rule, weight of each rule, buy threshold, sell threshold],
+    # see make_parameter_matrix.  The rules_list gives the compared columns and day offsets.
+    ticker_extra_df = get_indicator_data(ticker, base_time, now_time, price_df)
+    if ticker_extra_df.empty:
+        return np.array([]), np.array([]), np.empty((len(parameter_matrix), 0)), np.full(len(parameter_matrix), np.nan)
+    ticker_full_df = trim_indicator_data(ticker_extra_df, base_time, now_time)
+
+    return get_indicator_batch_roi(ticker_extra_df, ticker_full_df, rules_list, parameter_matrix, starting_value)
+
+
+def get_indicator_batch_roi(ticker_extra_df, ticker_full_df, rules_list, parameter_matrix, starting_value):
+    all_days = ticker_full_df.index.values
+    all_extra_days = ticker_extra_df.index.values
+    percentages, weights, buy_thresholds, sell_thresholds = split_parameter_matrix(parameter_matrix, len(rules_list))
+
+    sum_array = make_batch_decisions(ticker_extra_df, all_extra_days, all_days, rules_list, percentages, weights)
+    simple_values, strategic_values, decisions, states = run_backtest(
+        sum_array, ticker_full_df['Close'].values, buy_thresholds, sell_thresholds, starting_value)
+    strategic_rois = strategic_values[:, -1]/strategic_values[:, 0]
+
+    return all_days, simple_values, strategic_values, strategic_rois
+
+
+def make_parameter_matrix(rules_list, buy_threshold, sell_threshold):
+    # The single row parameter matrix of a rules list as shown in the signal table
+    row = [rule['Percentage'] for rule in rules_list] + [rule['Weight'] for rule in rules_list]
+    return np.array([row + [buy_threshold, sell_threshold]], dtype=float)
+
+
+def split_parameter_matrix(parameter_matrix, n_rules):
+    parameter_matrix = np.atleast_2d(np.asarray(parameter_matrix, dtype=float))
+    percentages = parameter_matrix[:, :n_rules]
+    weights = parameter_matrix[:, n_rules:2*n_rules]
+    buy_thresholds = parameter_matrix[:, 2*n_rules:2*n_rules+1]
+    sell_thresholds = parameter_matrix[:, 2*n_rules+1:2*n_rules+2]
+    return percentages, weights, buy_thresholds, sell_thresholds
+
+
+def get_indicator_data(ticker, base_time, now_time, price_df=None):
+    early_time = base_time-datetime.timedelta(days=365)
+    if price_df is None:
+        ticker_extra_df = stock_calculations.get_yahoo_stock_data([ticker], early_time.strftime("%Y-%m-%d"), now_time.strftime('%Y-%m-%d'))
+    else:
+        # Prices already loaded by the caller, e.g. a column of the universe price panel
+        ticker_extra_df = price_df.loc[(price_df.index >= early_time.strftime("%Y-%m-%d")) & (price_df.index < now_time.strftime('%Y-%m-%d'))].copy()
+    if ticker_extra_df.empty:
+        return ticker_extra_df
     # ticker_extra_df = get_data([ticker], early_time, now_time)
     ticker_extra_df['50'] = ticker_extra_df.Close.rolling(window=50).mean()
     ticker_extra_df['200'] = ticker_extra_df.Close.rolling(window=200).mean()
+    return ticker_extra_df
+
 
+def trim_indicator_data(ticker_extra_df, base_time, now_time):
     # Trim the dataframe to remove the extra time
     np_end_date = stock_calculations.make_np_date(now_time)
     np_start_date = stock_calculations.make_np_date(base_time)
     ticker_full_df = ticker_extra_df.loc[(ticker_extra_df.index.values <= np_end_date) & (ticker_extra_df.index.values >= np_start_date), :]
+    return ticker_full_df
+
 
+def get_indicator_roi(ticker_extra_df, ticker_full_df, rules_list, buy_threshold, sell_threshold, starting_value):
     # Create a list of each trading day
     all_days = ticker_full_df.index.values
     all_extra_days = ticker_extra_df.index.values
 
     # Make the daily trades for the simple and strategic strategy
     rule_df = make_decisions(ticker_extra_df, all_extra_days, all_days, rules_list)
-    values_df = get_values(all_days, ticker_full_df, rule_df, buy_threshold, sell_threshold, starting_value)
-
-    # Calculate the portfolio performance and create data frames
+    values_df = get_values(all_days, ticker_full_df.copy(), rule_df, buy_threshold, sell_threshold, starting_value)
     return values_df
 
 
@@ -146,165 +272,107 @@ def get_values(all_days, ticker_full_df, rule_df, buy_threshold, sell_threshold,
     ticker_full_df.loc[:, "sum"] = rule_df['sum']
     sum_array = ticker_full_df['sum'].values
     value_array = ticker_full_df['Close'].values
-    strategic_value_list = []
-    strategic_decision_list = []
-    strategic_state_list = []
-    simple_value_list = []
-
-    i = 0
-    for sum, value in zip(sum_array, value_array):
-        action='Hold'
-        if sum > buy_threshold:
-            action = "Buy"
-        elif sum < sell_threshold:
-            action = "Sell"
-
-        if i == 0:
-            # strategic_value_list.append(starting_value)
-            # strategic_decision_list.append("Buy")
-            # strategic_state_list.append("Invested")
-            strategic_value_list.append(starting_value)
-            if action == "Buy":
-                strategic_state_list.append("Invested")
-                strategic_decision_list.append(action)
-            elif action == "Sell":
-                strategic_state_list.append("Cash")
-                strategic_decision_list.append(action)
-            else:  # Hold
-                # When in doubt, buy in to start the investment.  This is a difference to the historic method.
-                strategic_state_list.append("Invested")
-                strategic_decision_list.append("Buy")
-            simple_value_list.append(starting_value)
-        else:
-            simple_value_list.append(simple_value_list[i-1]*value/value_array[i-1])
-            if strategic_decision_list[i-1] == 'Buy':
-                strategic_value_list.append(strategic_value_list[i-1]*value/value_array[i-1])
-                strategic_state_list.append("Invested")
-                if action == 'Buy':
-                    strategic_decision_list.append("Hold")
-                else:
-                    strategic_decision_list.append(action)
-            elif strategic_decision_list[i-1] == 'Sell':
-                strategic_value_list.append(strategic_value_list[i-1])
-                strategic_state_list.append("Cash")
-                if action== 'Sell':
-                    strategic_decision_list.append("Hold")
-                else:
-                    strategic_decision_list.append(action)
-            else: #Hold
-                if strategic_state_list[i-1] == 'Invested':
-                    strategic_value_list.append(strategic_value_list[i-1]*value/value_array[i-1])
-                    strategic_state_list.append("Invested")
-                    if action == 'Buy':
-                        strategic_decision_list.append("Hold")
-                    else:
-                        strategic_decision_list.append(action)
-                else:
-                    strategic_value_list.append(strategic_value_list[i-1])
-                    strategic_state_list.append("Cash")
-                    if action == 'Sell':
-                        strategic_decision_list.append("Hold")
-                    else:
-                        strategic_decision_list.append(action)
-
-        i = i+1
-    ticker_full_df.loc[:, "simple_values"] = simple_value_list
-    ticker_full_df.loc[:, "strategic_values"] = strategic_value_list
-    ticker_full_df.loc[:, "strategic_decisions"] = strategic_decision_list
-    ticker_full_df.loc[:, "strategic_state"] = strategic_state_list
+    simple_values, strategic_values, decisions, states = run_backtest(
+        sum_array, value_array, buy_threshold, sell_threshold, starting_value)
+
+    ticker_full_df.loc[:, "simple_values"] = simple_values
+    ticker_full_df.loc[:, "strategic_values"] = strategic_values
+    ticker_full_df.loc[:, "strategic_decisions"] = decisions
+    ticker_full_df.loc[:, "strategic_state"] = states
 
     return ticker_full_df
 
 
-def make_decisions(ticker_extra_df, all_extra_days, all_days, rules_list):
-    # profile = cProfile.Profile()
-    # profile.enable()
+def run_backtest(sum_array, value_array, buy_threshold, sell_threshold, starting_value, starting_state=None):
+    # Works along the last axis, so sum_array can be one strategy (days,) or a batch (K, days)
+    # with thresholds of shape (K, 1).  starting_state continues an earlier backtest from one of its
+    # days, whose state and strategic value are starting_state and starting_value.
+    n_days = sum_array.shape[-1]
+    actions = np.where(sum_array > buy_threshold, BUY, np.where(sum_array < sell_threshold, SELL, HOLD))
+    if n_days:
+        # When in doubt, buy in to start the investment.  This is a difference to the historic method.
+        # A continued backtest keeps its state instead.
+        first_action = BUY if starting_state is None or starting_state == INVESTED else SELL
+        actions[..., 0] = np.where(actions[..., 0] == HOLD, first_action, actions[..., 0])
+
+    # A Buy or Sell sets the state for the next day, a Hold carries the last state forward
+    last_signal = np.maximum.accumulate(np.where(actions != HOLD, np.arange(n_days), 0), axis=-1)
+    next_states = np.where(np.take_along_axis(actions, last_signal, axis=-1) == BUY, INVESTED, CASH)
+    states = np.concatenate([next_states[..., :1], next_states[..., :-1]], axis=-1)
+    if starting_state is not None and n_days:
+        states[..., 0] = starting_state
+
+    # Signals that agree with the current state are held, the first day always trades
+    decisions = np.where(next_states != states, actions, HOLD)
+    decisions[..., :1] = actions[..., :1]
+
+    day_returns = np.ones(n_days)
+    day_returns[1:] = value_array[1:]/value_array[:-1]
+    simple_values = starting_value*np.cumprod(day_returns)
+    strategic_values = starting_value*np.cumprod(np.where(states == INVESTED, day_returns, 1.0), axis=-1)
+
+    return simple_values, strategic_values, decisions, states
+
+
+def get_day_index(all_extra_days, all_days):
+    # Position of each trading day in the frame that includes the extra lookback year
     offset = 0
-    for ie, extra_day in enumerate(all_extra_days):
-        if extra_day == all_days[0]:
-            offset = ie
+    offset_matches = np.flatnonzero(all_extra_days == all_days[0])
+    if offset_matches.size:
+        offset = offset_matches[-1]
+    return np.arange(len(all_days)) + offset
+
+
+def make_decisions(ticker_extra_df, all_extra_days, all_days, rules_list):
+    # Each rule is evaluated as one shifted comparison over the whole trading window
+    day_index = get_day_index(all_extra_days, all_days)
 
-    rule_results = []
-    # print(ticker_extra_df)
     if rules_list:
+        rule_results = []
         for rule in rules_list:
-            weight_list = []
             larger_array = ticker_extra_df[rule["Larger: What?"]].to_numpy()
             smaller_array = ticker_extra_df[rule["Smaller: What?"]].to_numpy()
-            # time_array = ticker_extra_df.index.to_numpy()
-            for i, day in enumerate(all_days):
-                larger_value = larger_array[i+offset+rule['Larger: When?']]
-                smaller_value = smaller_array[i+offset+rule['Smaller: When?']]
-                weight = 0
-                if larger_value > smaller_value*(1+rule['Percentage']/100):
-                    weight = rule['Weight']
+            rule_results.append(make_rule_weights(larger_array, smaller_array, day_index, rule))
+        rule_columns = ["{}".format(i) for i in range(len(rules_list))]
+    else:
+        rule_results = [np.zeros(len(all_days), dtype=int)]
+        rule_columns = ['0']
 
-                weight_list.append(weight)
+    rule_df = pd.DataFrame(np.array(rule_results).T, index=all_days, columns=rule_columns)
+    rule_df['sum'] = rule_df[list(rule_df.columns)].sum(axis=1)
 
-            rule_results.append(weight_list)
-    else:
-        weight_list = []
-        for i, day in enumerate(all_days):
-            weight = 0
-            weight_list.append(weight)
+    return rule_df
 
-        rule_results.append(weight_list)
 
-    rule_df = pd.DataFrame.from_records(rule_results).T
-    rule_df.index = all_days
-    if rules_list:
-        rule_df.columns = ["{}".format(i) for i in range(len(rules_list))]
-        rule_df['sum'] = rule_df[list(rule_df.columns)].sum(axis=1)
-    else:
-        rule_df.columns = ['0']
-        rule_df['sum'] = rule_df[list(rule_df.columns)].sum(axis=1)
-    # profile.disable()
-    # s = io.StringIO()
-    # ps = pstats.Stats(profile, stream=s).sort_stats("cumtime")
-    # ps.print_stats()
-    # with open('test.txt', 'w+') as f:
-    #     f.write(s.getvalue())
+def make_batch_decisions(ticker_extra_df, all_extra_days, all_days, rules_list, percentages, weights):
+    # The rule sums for K parameter sets at once, percentages and weights have shape (K, rules)
+    day_index = get_day_index(all_extra_days, all_days)
+    sum_array = np.zeros((percentages.shape[0], len(all_days)))
+    for i, rule in enumerate(rules_list):
+        larger_values = ticker_extra_df[rule["Larger: What?"]].to_numpy()[day_index + int(rule['Larger: When?'])]
+        smaller_values = ticker_extra_df[rule["Smaller: What?"]].to_numpy()[day_index + int(rule['Smaller: When?'])]
+        is_larger = larger_values > smaller_values*(1+percentages[:, i:i+1]/100)
+        sum_array += np.where(is_larger, weights[:, i:i+1], 0)
 
-    return rule_df
+    return sum_array
+
+
+def make_rule_weights(larger_array, smaller_array, day_index, rule):
+    larger_values = larger_array[day_index + int(rule['Larger: When?'])]
+    smaller_values = smaller_array[day_index + int(rule['Smaller: When?'])]
+    is_larger = larger_values > smaller_values*(1+rule['Percentage']/100)
+    return np.where(is_larger, rule['Weight'], 0)
 
 
 def get_data(ticker_list, start_time, end_time):
-    ticker=ticker_list[0]
-    data_dir = r'./assets/sp500/'
-    file = os.path.join(data_dir, ticker+".csv")
-
-    if end_time.weekday() > 4:
-        if end_time.weekday() == 5:
-            end_time = end_time - datetime.timedelta(days=1)
-        elif end_time.weekday() == 6:
-            end_time = end_time - datetime.timedelta(days=2)
-
-    if os.path.isfile(file):
-        existing_df = pd.read_csv(file)
-        if not existing_df.empty:
-            df_start_time = datetime.datetime.strptime(existing_df["Date"].iloc[0], '%Y-%m-%d')
-            df_end_time = datetime.datetime.strptime(existing_df["Date"].iloc[-1], '%Y-%m-%d')
-
-            if df_start_time.date() <= start_time.date() and df_end_time.date() >= end_time.date():
-                existing_df.index = pd.to_datetime(existing_df["Date"], format = '%Y-%m-%d')
-                df = existing_df.loc[(existing_df.index>=start_time) & (existing_df.index<=end_time)]
-                # print("used existing data")
-            else:
-                df = stock_calculations.get_yahoo_stock_data([ticker], start_time - datetime.timedelta(days=365 * 2), end_time)
-                df.to_csv(file)
-        else:
-            df = stock_calculations.get_yahoo_stock_data([ticker], start_time - datetime.timedelta(days=365 * 2),
-                                                         end_time)
-            df.to_csv(file)
-    else:
-        df = stock_calculations.get_yahoo_stock_data([ticker], start_time-datetime.timedelta(days=365*2), end_time)
-        df.to_csv(file)
-    return df
+    # The per-ticker csv files are replaced by the binary price store behind get_yahoo_stock_data
+    return stock_calculations.get_yahoo_stock_data(ticker_list[:1], start_time, end_time)
 
 
 def make_spy_graph(ticker, values_df):
     spy_value = go.Figure()
     factor = values_df['simple_values'][0]/values_df['Close'][0]
+    decision_labels = values_df['strategic_decisions'].map(DECISION_LABELS)
     spy_value.add_trace(go.Scatter(
         x=values_df.index, y=values_df['simple_values'], name='Simple'
     ))
@@ -318,13 +386,13 @@ def make_spy_graph(ticker, values_df):
     #     x=values_df.index, y=values_df['50']*factor, name='50'
     # ))
     spy_value.add_trace(go.Scatter(
-        x=values_df.loc[values_df['strategic_decisions'] == 'Sell'].index,
-        y=values_df.loc[values_df['strategic_decisions'] == 'Sell', 'Close']*factor,
+        x=values_df.loc[decision_labels == 'Sell'].index,
+        y=values_df.loc[decision_labels == 'Sell', 'Close']*factor,
         mode='markers', name='Sell', marker_symbol='triangle-down', marker_color='Red', marker_size=12
     ))
     spy_value.add_trace(go.Scatter(
-        x=values_df.loc[values_df['strategic_decisions'] == 'Buy'].index,
-        y=values_df.loc[values_df['strategic_decisions'] == 'Buy', 'Close']*factor,
+        x=values_df.loc[decision_labels == 'Buy'].index,
+        y=values_df.loc[decision_labels == 'Buy', 'Close']*factor,
         mode='markers', name='Buy', marker_symbol='triangle-up', marker_color='Green', marker_size=12
     ))
     spy_value.update_layout(showlegend=True,
@@ -382,6 +450,15 @@ def signal_to_dict(signal_list):
     return data
 
 
+def get_strategy_rules(user, strategy_name):
+    # The rules and thresholds of a saved strategy, no rules for a trade without one
+    if strategy_name:
+        strategy = Strategy.query.filter_by(user_id=user.id, name=strategy_name).one_or_none()
+        rules_list = signal_to_dict(Signal.query.filter_by(strategy_id=strategy.id).all())
+        return rules_list, strategy.buy_threshold, strategy.sell_threshold
+    return [], 0, 0
+
+
 def get_values_df(row_data, user):
     # print(data[rows[0]])
     ticker = row_data['Name']
@@ -390,17 +467,66 @@ def get_values_df(row_data, user):
     start_date = datetime.datetime.strptime(row_data['Start Date'][0:10], '%Y-%m-%d')
     end_date = datetime.datetime.now()+datetime.timedelta(days=1)
     # print(start_date, end_date)
-    if strategy_name:
-        strategy = Strategy.query.filter_by(user_id=user.id, name=strategy_name).one_or_none()
-        buy_threshold = strategy.buy_threshold
-        sell_threshold = strategy.sell_threshold
-        rules_list = signal_to_dict(Signal.query.filter_by(strategy_id=strategy.id).all())
-    else:
-        rules_list = []
-        buy_threshold = 0
-        sell_threshold = 0
+    rules_list, buy_threshold, sell_threshold = get_strategy_rules(user, strategy_name)
 
     # print(rules_list)
     values_df = get_roi(ticker, start_date, end_date, rules_list, buy_threshold, sell_threshold, value)
 
     return values_df
+
+
+def get_lot_values(row_list, user, resume=None):
+    # The strategic values and states of many trades (rows as made by trade_to_dict) as dates x
+    # trades matrices, NaN outside a trade's dates.  Trades of the same ticker and strategy share one
+    # download and one set of rule sums over their combined dates.  Each distinct start date only
+    # reruns the backtest kernel from a unit value, which each trade scales by its own value, so a
+    # trade's curve is the same as get_values_df gives for it alone.  resume maps row indices to the
+    # (date, value, state) of a day already computed, from which those trades continue instead of
+    # starting again at their Start Date.
+    resume = resume or {}
+    end_date = datetime.datetime.now()+datetime.timedelta(days=1)
+    groups = {}
+    for i, row_data in enumerate(row_list):
+        groups.setdefault((row_data['Name'], row_data['Strategy']), []).append(i)
+
+    lot_values = {}
+    for (ticker, strategy_name), lot_indices in groups.items():
+        rules_list, buy_threshold, sell_threshold = get_strategy_rules(user, strategy_name)
+        starts = {}
+        for i in lot_indices:
+            if i in resume:
+                starts[i] = resume[i]
+            else:
+                starts[i] = (datetime.datetime.strptime(row_list[i]['Start Date'][0:10], '%Y-%m-%d'),
+                             row_list[i]['Value'], None)
+        first_date = min(start_date for start_date, value, state in starts.values())
+        ticker_extra_df = get_indicator_data(ticker, first_date, end_date)
+        if ticker_extra_df.empty:
+            continue
+        ticker_full_df = trim_indicator_data(ticker_extra_df, first_date, end_date)
+        all_days = ticker_full_df.index.values
+        sum_array = make_decisions(ticker_extra_df, ticker_extra_df.index.values, all_days, rules_list)['sum'].values
+        value_array = ticker_full_df['Close'].values
+
+        unit_values = {}
+        for i in lot_indices:
+            start_date, value, state = starts[i]
+            if (start_date, state) not in unit_values:
+                first = np.searchsorted(all_days, stock_calculations.make_np_date(start_date))
+                simple_values, strategic_values, decisions, states = run_backtest(
+                    sum_array[first:], value_array[first:], buy_threshold, sell_threshold, 1, state)
+                unit_values[(start_date, state)] = (all_days[first:], strategic_values, states)
+            lot_days, strategic_values, states = unit_values[(start_date, state)]
+            lot_values[i] = (lot_days, value*strategic_values, states)
+
+    lots = sorted(lot_values)
+    if not lots:
+        return np.array([], dtype='datetime64[ns]'), lots, np.empty((0, 0)), np.empty((0, 0))
+    dates = np.unique(np.concatenate([lot_values[i][0] for i in lots]))
+    values_matrix = np.full((len(dates), len(lots)), np.nan)
+    states_matrix = np.full((len(dates), len(lots)), np.nan)
+    for column, i in enumerate(lots):
+        lot_days, values, states = lot_values[i]
+        values_matrix[np.searchsorted(dates, lot_days), column] = values
+        states_matrix[np.searchsorted(dates, lot_days), column] = states
+    return dates, lots, values_matrix, states_matrix
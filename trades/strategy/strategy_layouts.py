@@ -166,7 +166,27 @@ def make_optimize_controls():
             id='opt_button',
             children="Optimize",
             block=True),
-        dbc.FormText("Optimization can take >1 Min.")
+        dbc.FormText("Optimization can take >1 Min."),
+        dbc.Row([
+            dbc.Col([
+                dbc.Button(
+                    id='opt_accept_button',
+                    children="Use Best So Far",
+                    block=True,
+                    outline=True),
+            ]),
+            dbc.Col([
+                dbc.Button(
+                    id='opt_cancel_button',
+                    children="Cancel",
+                    block=True,
+                    outline=True),
+            ]),
+        ]),
+        # The optimization runs as a background job, polled while opt_interval is enabled
+        dcc.Interval(id='opt_interval', interval=2000, disabled=True),
+        html.Div(id='opt_job', style={'display': 'None'}),
+        html.Div(id='opt_results', style={'display': 'None'}),
     ])
 
     optimize_controls = html.Div([
@@ -300,7 +320,7 @@ def make_dashboard_controls():
                         style={"position": "fixed", "top": 0}),
                     dbc.Alert(
                         id='opt_alert',
-                        duration=4000,
+                        dismissable=True,
                         is_open=False,
                         children="",
                         color='success',
@@ -0,0 +1,36 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class TtlCache:
+    # Computes values on the first get of their key and keeps them for ttl seconds.  The least
+    # recently used entries are dropped after max_entries.  Values are made outside the lock, so two
+    # threads missing the same key both make it and the later one is kept.
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, make_value):
+        with self.lock:
+            if key in self.entries:
+                value, expires = self.entries[key]
+                if expires > time.time():
+                    self.entries.move_to_end(key)
+                    return value
+                del self.entries[key]
+
+        value = make_value()
+        with self.lock:
+            self.entries[key] = (value, time.time() + self.ttl)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return value
+
+    def drop(self, is_dropped):
+        # Removes the entries whose key is_dropped accepts
+        with self.lock:
+            for key in [key for key in self.entries if is_dropped(key)]:
+                del self.entries[key]